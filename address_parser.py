@@ -0,0 +1,232 @@
+import json
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import usaddress
+from config import address_cache_db
+
+STATE_ABBREVIATIONS = {
+    'Alabama': 'AL',
+    'Alaska': 'AK',
+    'Arizona': 'AZ',
+    'Arkansas': 'AR',
+    'California': 'CA',
+    'Colorado': 'CO',
+    'Connecticut': 'CT',
+    'Delaware': 'DE',
+    'District of Columbia': 'DC',
+    'Florida': 'FL',
+    'Georgia': 'GA',
+    'Hawaii': 'HI',
+    'Idaho': 'ID',
+    'Illinois': 'IL',
+    'Indiana': 'IN',
+    'Iowa': 'IA',
+    'Kansas': 'KS',
+    'Kentucky': 'KY',
+    'Louisiana': 'LA',
+    'Maine': 'ME',
+    'Maryland': 'MD',
+    'Massachusetts': 'MA',
+    'Michigan': 'MI',
+    'Minnesota': 'MN',
+    'Mississippi': 'MS',
+    'Missouri': 'MO',
+    'Montana': 'MT',
+    'Nebraska': 'NE',
+    'Nevada': 'NV',
+    'New Hampshire': 'NH',
+    'New Jersey': 'NJ',
+    'New Mexico': 'NM',
+    'New York': 'NY',
+    'North Carolina': 'NC',
+    'North Dakota': 'ND',
+    'Ohio': 'OH',
+    'Oklahoma': 'OK',
+    'Oregon': 'OR',
+    'Pennsylvania': 'PA',
+    'Rhode Island': 'RI',
+    'South Carolina': 'SC',
+    'South Dakota': 'SD',
+    'Tennessee': 'TN',
+    'Texas': 'TX',
+    'Utah': 'UT',
+    'Vermont': 'VT',
+    'Virginia': 'VA',
+    'Washington': 'WA',
+    'West Virginia': 'WV',
+    'Wisconsin': 'WI',
+    'Wyoming': 'WY'
+}
+
+# USPS standard abbreviations of the common street types, so 'Street' and 'St' are the same street
+# while 'St' and 'Ave' stay different streets
+STREET_TYPE_ABBREVIATIONS = {
+    'alley': 'aly',
+    'avenue': 'ave',
+    'av': 'ave',
+    'boulevard': 'blvd',
+    'circle': 'cir',
+    'court': 'ct',
+    'crescent': 'cres',
+    'crossing': 'xing',
+    'drive': 'dr',
+    'expressway': 'expy',
+    'extension': 'ext',
+    'freeway': 'fwy',
+    'heights': 'hts',
+    'highway': 'hwy',
+    'hill': 'hl',
+    'lane': 'ln',
+    'parkway': 'pkwy',
+    'place': 'pl',
+    'plaza': 'plz',
+    'point': 'pt',
+    'road': 'rd',
+    'square': 'sq',
+    'street': 'st',
+    'str': 'st',
+    'terrace': 'ter',
+    'trail': 'trl',
+    'turnpike': 'tpke',
+}
+
+DIRECTION_ABBREVIATIONS = {
+    'north': 'n',
+    'south': 's',
+    'east': 'e',
+    'west': 'w',
+    'northeast': 'ne',
+    'northwest': 'nw',
+    'southeast': 'se',
+    'southwest': 'sw',
+}
+
+# Parse results of this run, on top of the on-disk cache
+_parsed = {}
+
+
+def normalize_address(address):
+    """Collapse repeated whitespace. usaddress splits on whitespace, so this doesn't change the parse
+    """
+    return ' '.join(str(address).split())
+
+
+def tag_address(address):
+    """Return the usaddress components of an address or None if it can't be tagged"""
+    try:
+        components, address_type = usaddress.tag(address)
+        return dict(components)
+    except usaddress.RepeatedLabelError:
+        return None
+
+
+def open_cache():
+    db = sqlite3.connect(address_cache_db)
+    db.execute('CREATE TABLE IF NOT EXISTS addresses (address TEXT PRIMARY KEY, components TEXT)')
+    return db
+
+
+def read_cache(addresses):
+    found = {}
+    addresses = list(addresses)
+    with open_cache() as db:
+        # Stay below the sqlite limit on the number of query parameters
+        for i in range(0, len(addresses), 900):
+            chunk = addresses[i:i + 900]
+            params = ','.join('?' * len(chunk))
+            query = f'SELECT address, components FROM addresses WHERE address IN ({params})'
+            for address, components in db.execute(query, chunk):
+                found[address] = json.loads(components)
+    return found
+
+
+def write_cache(parsed):
+    with open_cache() as db:
+        db.executemany('INSERT OR REPLACE INTO addresses VALUES (?, ?)',
+                       ((address, json.dumps(c)) for address, c in parsed.items()))
+
+
+def parse_addresses(addresses, workers=None):
+    """ Tag a Series of addresses with usaddress and return a Series (same index) with the
+        components dict of every address, or None when it can't be tagged.
+        Every distinct address is parsed only once: results are kept in memory for the run and in
+        address_cache_db across runs, and the addresses that aren't cached yet are tagged across
+        a process pool.
+    """
+    normalized = addresses.map(normalize_address)
+    unique = set(normalized.unique())
+
+    missing = unique - _parsed.keys()
+    _parsed.update(read_cache(missing))
+    missing = sorted(missing - _parsed.keys())
+    if missing:
+        print(f'parsing {len(missing):,} new addresses ({len(unique):,} distinct)')
+        if len(missing) < 1000:
+            results = map(tag_address, missing)
+            parsed = dict(zip(missing, results))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(tag_address, missing, chunksize=500)
+                parsed = dict(zip(missing, results))
+        write_cache(parsed)
+        _parsed.update(parsed)
+
+    return pd.Series([_parsed[a] for a in normalized], index=addresses.index, dtype=object)
+
+
+def extract_zip_code(components):
+    """5 digit zip code of a parsed address or ''"""
+    if not components:
+        return ''
+    zip_code = components.get('ZipCode', '').split('-')[0].strip()
+    return zip_code.zfill(5) if zip_code else ''
+
+
+def abbrev_state(state_name):
+    state_name = state_name.strip(' .,')
+    if len(state_name) == 2:
+        return state_name.upper()
+    return STATE_ABBREVIATIONS.get(state_name.title(), state_name)
+
+
+def abbrev_street_type(street_type):
+    street_type = street_type.lower().strip(' .,')
+    return STREET_TYPE_ABBREVIATIONS.get(street_type, street_type)
+
+
+def abbrev_direction(direction):
+    direction = direction.lower().replace('.', '').strip(' ,')
+    return DIRECTION_ABBREVIATIONS.get(direction, direction)
+
+
+def street_address(components):
+    """ Lower case (number, "directions street-types street-name", unit) of a parsed address, with
+        the street types and directions abbreviated, so '12 North Main Street' and '12 N Main St'
+        are the same and '12 N Main St' and '12 S Main St' are not
+    """
+    street = [abbrev_direction(components.get('StreetNamePreDirectional', '')),
+              abbrev_street_type(components.get('StreetNamePreType', '')),
+              components.get('StreetName', '').lower(),
+              abbrev_street_type(components.get('StreetNamePostType', '')),
+              abbrev_direction(components.get('StreetNamePostDirectional', ''))]
+    unit = [components.get(label, '').lower() for label in ('OccupancyType', 'OccupancyIdentifier')]
+    return (components.get('AddressNumber', '').lower().strip(' ,'),
+            ' '.join(p.strip(' ,') for p in street if p.strip(' ,')),
+            ' '.join(p.strip(' ,') for p in unit if p.strip(' ,')))
+
+
+def canonical_address(address, components, zip_code=''):
+    """ Lower case "number direction street street-type direction unit city state zip" of a
+        parsed address (see street_address), or the lower cased address if it couldn't be parsed.
+        The unit is kept so households in the same building can be told apart (see households.py)
+        and the zip code (zip_code when the address has none) so update_zip_code finds it again
+        in the canonical address.
+    """
+    if not components:
+        return address.lower()
+    parts = list(street_address(components))
+    parts.append(components.get('PlaceName', ''))
+    parts.append(abbrev_state(components.get('StateName', '')))
+    parts.append(extract_zip_code(components) or zip_code)
+    return ' '.join(p.strip(' ,') for p in parts if p.strip(' ,')).lower()
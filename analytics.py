@@ -0,0 +1,297 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import json
+import os
+import numpy as np
+import pandas as pd
+from config import (
+    final_merged_people_csv,
+    org_overlap_report_json,
+    household_overlap_report_json,
+    org_combinations_json,
+    org_reports_dir
+)
+from geography import category_membership, load_org_categories
+from households import load_household_membership
+from main import read_people_membership
+
+# Number of set bits of every byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def load_membership(path=final_merged_people_csv):
+    """ Load only the org membership of the merged people file, from its org columns or its
+        membership file (see main.write_membership), as a people x orgs uint8 matrix.
+        Returns (org names, matrix).
+    """
+    return read_people_membership(path)
+
+
+def overlap_counts(membership, chunk_size=100_000):
+    """ Return (co-occurrence, lists distribution) for a people x orgs membership matrix:
+        co_occurrence[o, p] is the number of people on both o and p (the diagonal is the size of
+        every list) and lists_distribution[o, k] is the number of people on o that are on
+        exactly k lists.
+        Both are matrix products over the membership, computed on row chunks to bound the memory
+        of the float copies (float32 is exact for counts of a chunk).
+    """
+    n_orgs = membership.shape[1]
+    lists_per_person = membership.sum(axis=1, dtype=np.int64)
+    max_lists = int(lists_per_person.max()) if len(lists_per_person) else 0
+    co_occurrence = np.zeros((n_orgs, n_orgs), dtype=np.int64)
+    lists_distribution = np.zeros((n_orgs, max_lists + 1), dtype=np.int64)
+    for start in range(0, len(membership), chunk_size):
+        chunk = membership[start:start + chunk_size].astype(np.float32)
+        lists = np.zeros((len(chunk), max_lists + 1), dtype=np.float32)
+        lists[np.arange(len(chunk)), lists_per_person[start:start + chunk_size]] = 1
+        co_occurrence += (chunk.T @ chunk).astype(np.int64)
+        lists_distribution += (chunk.T @ lists).astype(np.int64)
+    return co_occurrence, lists_distribution
+
+
+def org_metrics(orgs, membership, counts=None):
+    """ Per org metrics (one row per org) for a people x orgs membership matrix. counts are the
+        results of overlap_counts when they were already computed.
+    """
+    co_occurrence, lists_distribution = counts or overlap_counts(membership)
+    size = np.diag(co_occurrence)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        unique_proportion = np.where(size > 0, lists_distribution[:, 1] / size, np.nan)
+        # The distribution of the number of *other* lists is the lists distribution shifted by one
+        other_lists = lists_distribution[:, 1:]
+        mean_other_lists = np.where(size > 0, other_lists @ np.arange(other_lists.shape[1]) / size,
+                                    np.nan)
+        overlap_proportion = np.where(size[:, None] > 0, co_occurrence / size[:, None], np.nan)
+    overlapping_orgs = (co_occurrence > 0).sum(axis=1) - (size > 0)
+
+    metrics = pd.DataFrame({
+        'people': size,
+        'unique': lists_distribution[:, 1],
+        'unique_proportion': unique_proportion,
+        'shared_proportion': 1 - unique_proportion,
+        'mean_other_lists': mean_other_lists,
+        'overlapping_orgs': overlapping_orgs,
+    }, index=orgs)
+    return metrics, co_occurrence, other_lists, overlap_proportion
+
+
+def generate_overlap_report(path=final_merged_people_csv, households=False):
+    """ Write org_overlap_report_json with, for every org: its size, unique and shared proportion,
+        the distribution of the number of other lists its people are on and its overlap with every
+        other org, plus the median of every metric across all orgs as a benchmark.
+        households=True reports the same metrics per household (see households.py) to
+        household_overlap_report_json, 'people' counts are then households.
+    """
+    if households:
+        orgs, membership = load_household_membership()
+    else:
+        orgs, membership = load_membership(path)
+    unit = 'households' if households else 'people'
+    print(f'[{datetime.now().strftime("%H:%M")}] {len(membership):,} {unit} x {len(orgs):,} orgs')
+
+    metrics, co_occurrence, other_lists, overlap_proportion = org_metrics(orgs, membership)
+    lists_per_person = np.bincount(membership.sum(axis=1, dtype=np.int64))
+
+    report = dict(
+        people=len(membership),
+        lists_per_person={k: int(v) for k, v in enumerate(lists_per_person) if v},
+        benchmarks=metrics[metrics['people'] > 0].median().to_dict(),
+        orgs={},
+    )
+    org_rows = metrics.astype(object).where(metrics.notna(), None).to_dict('index')
+    for i, org in enumerate(orgs):
+        others = np.flatnonzero(co_occurrence[i])
+        report['orgs'][org] = dict(
+            **org_rows[org],
+            other_lists_distribution={k: int(v) for k, v in enumerate(other_lists[i]) if v},
+            overlap={orgs[j]: dict(people=int(co_occurrence[i, j]),
+                                   proportion=float(overlap_proportion[i, j]))
+                     for j in others if j != i},
+        )
+
+    report_json = household_overlap_report_json if households else org_overlap_report_json
+    json.dump(report, open(report_json, 'w'), indent=2)
+    print('Overlap report created:', report_json)
+
+
+def popcount(bits):
+    """Number of set bits of every row of a uint64 bitset matrix (or of a single bitset)"""
+    if hasattr(np, 'bitwise_count'):  # numpy >= 2.0
+        return np.bitwise_count(bits).sum(axis=-1, dtype=np.int64)
+    return POPCOUNT[bits.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+def pack_columns(membership):
+    """Pack every column of a people x items 0/1 matrix into a bitset of uint64 words"""
+    bits = np.packbits(membership.astype(bool), axis=0).T
+    padding = -bits.shape[1] % 8
+    bits = np.pad(bits, ((0, 0), (0, padding)))
+    return np.ascontiguousarray(bits).view(np.uint64)
+
+
+def frequent_itemsets(membership, min_support=0.01, max_size=None):
+    """ Apriori over a people x items 0/1 matrix: every person is a transaction and every column an
+        item. Returns {itemset (tuple of column indices): number of people} for every set of items
+        that at least min_support of the people are on together.
+
+        Pairs are counted all at once from the co-occurrence matrix (see overlap_counts). Larger
+        sets are counted on bitsets of the people on every item: candidates of size k are the
+        unions of frequent sets of size k - 1 that share all but their last item, are only counted
+        when all their subsets are frequent, and their support is the popcount of the AND of the
+        bitset of their first parent with the bitset of their last item. Bitsets of pairs are not
+        kept, as there can be many of them.
+    """
+    min_count = max(1, int(np.ceil(min_support * len(membership))))
+    co_occurrence = overlap_counts(membership)[0]
+    counts = np.diag(co_occurrence)
+    frequent = {(i,): int(counts[i]) for i in np.flatnonzero(counts >= min_count)}
+    if max_size == 1:
+        return frequent
+
+    pairs = np.argwhere(np.triu(co_occurrence >= min_count, k=1))
+    frequent.update({(i, j): int(co_occurrence[i, j]) for i, j in pairs})
+    items = np.unique(pairs)
+    column_bits = dict(zip(items, pack_columns(membership[:, items]))) if len(items) else {}
+    level = {(i, j): None for i, j in pairs}
+
+    size = 2
+    while level and (max_size is None or size < max_size):
+        by_prefix = {}
+        for itemset in sorted(level):
+            by_prefix.setdefault(itemset[:-1], []).append(itemset)
+        next_level = {}
+        for itemsets in by_prefix.values():
+            for i, a in enumerate(itemsets):
+                for b in itemsets[i + 1:]:
+                    candidate = a + b[-1:]
+                    if any(candidate[:j] + candidate[j + 1:] not in level
+                           for j in range(len(candidate) - 2)):
+                        continue
+                    parent_bits = level[a]
+                    if parent_bits is None:
+                        parent_bits = column_bits[a[0]] & column_bits[a[1]]
+                    candidate_bits = parent_bits & column_bits[b[-1]]
+                    count = int(popcount(candidate_bits))
+                    if count >= min_count:
+                        next_level[candidate] = candidate_bits
+                        frequent[candidate] = count
+        level = next_level
+        size += 1
+    return frequent
+
+
+def combination_rows(names, frequent, people):
+    rows = [dict(items=[names[i] for i in itemset], people=count, support=count / people)
+            for itemset, count in frequent.items() if len(itemset) > 1]
+    return sorted(rows, key=lambda row: (-len(row['items']), -row['people']))
+
+
+def generate_combinations_report(path=final_merged_people_csv, min_support=0.01, max_size=None):
+    """ Write org_combinations_json with the combinations of org categories and of orgs that at
+        least min_support of the people on more than one list are on together (see
+        frequent_itemsets), largest combinations first.
+    """
+    orgs, membership = load_membership(path)
+    membership = membership[membership.sum(axis=1, dtype=np.int64) > 1]
+    categories, _, by_category = category_membership(load_org_categories(orgs), membership)
+    print(f'[{datetime.now().strftime("%H:%M")}] {len(membership):,} people on more than one list')
+
+    report = dict(people=len(membership), min_support=min_support)
+    for name, items, matrix in (('categories', list(categories), by_category),
+                                ('orgs', orgs, membership)):
+        frequent = frequent_itemsets(matrix, min_support, max_size)
+        report[name] = combination_rows(items, frequent, len(membership))
+        print(f'Frequent combinations of {name}:', f'{len(report[name]):,}')
+
+    json.dump(report, open(org_combinations_json, 'w'), indent=2)
+    print('Combinations report created:', org_combinations_json)
+
+
+def report_counts(membership, org_category, n_categories, zip_ids, n_zips, chunk_size=100_000):
+    """ Everything the org reports count, in one pass over row chunks of the membership matrix:
+        overlap_counts, the number of people of every org that are on another org of every
+        category (orgs x categories) and the number of people of every org in every zip code
+        (orgs x zips).
+        A person on org o is on another org of o's own category when they are on at least 2 orgs
+        of that category, and on another org of any other category when they are on at least 1.
+    """
+    n_orgs = membership.shape[1]
+    lists_per_person = membership.sum(axis=1, dtype=np.int64)
+    max_lists = int(lists_per_person.max()) if len(lists_per_person) else 0
+    categories = np.zeros((n_orgs, n_categories), dtype=np.float32)
+    categories[np.arange(n_orgs), org_category] = 1
+
+    co_occurrence = np.zeros((n_orgs, n_orgs), dtype=np.int64)
+    lists_distribution = np.zeros((n_orgs, max_lists + 1), dtype=np.int64)
+    on_one, on_two = (np.zeros((n_orgs, n_categories), dtype=np.int64) for _ in range(2))
+    by_zip = np.zeros(n_orgs * n_zips, dtype=np.int64)
+    for start in range(0, len(membership), chunk_size):
+        rows = slice(start, start + chunk_size)
+        chunk = membership[rows].astype(np.float32)
+        lists = np.zeros((len(chunk), max_lists + 1), dtype=np.float32)
+        lists[np.arange(len(chunk)), lists_per_person[rows]] = 1
+        per_category = chunk @ categories
+        co_occurrence += (chunk.T @ chunk).astype(np.int64)
+        lists_distribution += (chunk.T @ lists).astype(np.int64)
+        on_one += (chunk.T @ (per_category >= 1).astype(np.float32)).astype(np.int64)
+        on_two += (chunk.T @ (per_category >= 2).astype(np.float32)).astype(np.int64)
+        people, orgs = membership[rows].nonzero()
+        by_zip += np.bincount(orgs * n_zips + zip_ids[rows][people], minlength=n_orgs * n_zips)
+
+    own = np.arange(n_orgs), org_category
+    other_categories = on_one
+    other_categories[own] = on_two[own]
+    return co_occurrence, lists_distribution, other_categories, by_zip.reshape(n_orgs, n_zips)
+
+
+def write_org_report(report):
+    path = os.path.join(org_reports_dir, f"{report['org']}.json")
+    json.dump(report, open(path, 'w'), indent=2)
+    return path
+
+
+def generate_org_reports(path=final_merged_people_csv, workers=None):
+    """ Write a report for every org to org_reports_dir/{org}.json: its metrics (see org_metrics),
+        the distribution of the number of other lists its people are on, the categories of those
+        lists, the zip codes of its people and every metric next to its median and percentile
+        across all orgs. All orgs are counted together in one pass over the membership matrix
+        (see report_counts) and the reports are written across a process pool.
+    """
+    orgs, membership = load_membership(path)
+    has_zip = 'Zip Code' in pd.read_csv(path, nrows=0).columns
+    zip_codes = (pd.read_csv(path, usecols=['Zip Code'], dtype=str, keep_default_na=False)
+                 ['Zip Code'] if has_zip else pd.Series('', index=range(len(membership))))
+    zip_ids, zips = pd.factorize(zip_codes, sort=True)
+    categories, org_category = np.unique(load_org_categories(orgs), return_inverse=True)
+    print(f'[{datetime.now().strftime("%H:%M")}] {len(membership):,} people x {len(orgs):,} orgs')
+
+    co_occurrence, lists_distribution, other_categories, by_zip = report_counts(
+        membership, org_category, len(categories), zip_ids, len(zips))
+    metrics, _, other_lists, _ = org_metrics(orgs, membership, (co_occurrence, lists_distribution))
+    active = metrics[metrics['people'] > 0]
+    medians = active.median()
+    percentiles = active.rank(pct=True).reindex(metrics.index)
+
+    reports = []
+    org_rows = metrics.astype(object).where(metrics.notna(), None).to_dict('index')
+    for i, org in enumerate(orgs):
+        reports.append(dict(
+            org=org,
+            category=categories[org_category[i]],
+            **org_rows[org],
+            other_lists_distribution={k: int(v) for k, v in enumerate(other_lists[i]) if v},
+            other_list_categories={c: int(n) for c, n in zip(categories, other_categories[i]) if n},
+            zip_codes={zips[z]: int(by_zip[i, z]) for z in np.argsort(-by_zip[i], kind='stable')
+                       if by_zip[i, z]},
+            benchmarks={metric: dict(median=float(medians[metric]),
+                                     percentile=(None if pd.isna(percentiles.at[org, metric])
+                                                 else float(percentiles.at[org, metric])))
+                        for metric in metrics.columns},
+        ))
+
+    os.makedirs(org_reports_dir, exist_ok=True)
+    json.dump(dict(people=len(membership), benchmarks=medians.to_dict()),
+              open(os.path.join(org_reports_dir, 'benchmarks.json'), 'w'), indent=2)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(write_org_report, reports, chunksize=max(1, len(reports) // 64)))
+    print(f'{len(reports):,} org reports created:', org_reports_dir)
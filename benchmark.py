@@ -0,0 +1,193 @@
+""" Synthetic contact lists and an end to end benchmark of the pipeline stages.
+
+    python benchmark.py --orgs 20 --people 1000 10000 100000
+
+generates org lists with the col_list schema for every scale (people per list), runs every stage
+on them in a fresh process and appends the wall time and peak memory of every stage to
+benchmark_results.jsonl, so scaling curves and regressions can be tracked across commits.
+"""
+import argparse
+from datetime import datetime
+import json
+import os
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+FIRST_NAMES = [
+    'David', 'Sarah', 'Michael', 'Rachel', 'Daniel', 'Rebecca', 'Joshua', 'Leah', 'Benjamin',
+    'Hannah', 'Jacob', 'Miriam', 'Adam', 'Naomi', 'Samuel', 'Ruth', 'Jonathan', 'Deborah', 'Aaron',
+    'Esther', 'Noah', 'Abigail', 'Ethan', 'Talia', 'Eli', 'Maya', 'Ari', 'Shira', 'Ben', 'Dana',
+    'Jeffrey', 'Susan', 'Robert', 'Nancy', 'Richard', 'Judith', 'Steven', 'Ellen', 'Mark', 'Laura',
+]
+SYLLABLES = ['co', 'hen', 'le', 'vy', 'gold', 'berg', 'stein', 'man', 'fel', 'ro', 'sen', 'blum',
+             'katz', 'weiss', 'kap', 'lan', 'fried', 'shap', 'iro', 'green', 'field', 'baum', 'ner']
+STREET_NAMES = ['Beacon', 'Washington', 'Harvard', 'Commonwealth', 'Centre', 'Walnut', 'Chestnut',
+                'Boylston', 'Elm', 'Oak', 'Maple', 'Highland', 'Pleasant', 'Summer', 'Winter']
+STREET_TYPES = ['St', 'Street', 'Ave', 'Rd', 'Road', 'Way']
+TOWNS = [('Newton', '02458'), ('Brookline', '02446'), ('Boston', '02116'), ('Sharon', '02067'),
+         ('Needham', '02492'), ('Framingham', '01701'), ('Lexington', '02421'), ('Natick', '01760')]
+
+# Stages in pipeline order, each runs in its own process on the output of the previous ones
+STAGES = {
+    'merge_files': lambda main: main.merge_files(),
+    'generate_output_file': lambda main: main.generate_output_file(),
+    'find_suspected_duplicates': lambda main: main.find_suspected_duplicates(),
+    'update_zip_code': lambda main: main.run_pipeline([main.update_zip_code]),
+    'merge_candidates': lambda main: main.merge_candidates(),
+}
+
+
+def typo(word, rng):
+    if len(word) < 2:
+        return word
+    i = rng.randrange(len(word) - 1)
+    kind = rng.randrange(3)
+    if kind == 0:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]  # transposition
+    if kind == 1:
+        return word[:i] + word[i + 1:]  # deletion
+    return word[:i] + rng.choice(string.ascii_lowercase) + word[i + 1:]  # substitution
+
+
+def random_person(rng):
+    first = rng.choice(FIRST_NAMES)
+    last = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).title()
+    town, zip_code = rng.choice(TOWNS)
+    phone = f'({rng.randint(200, 999)}) {rng.randint(200, 999)}-{rng.randint(0, 9999):04}'
+    return {
+        'First Name': first,
+        'Last Name': last,
+        'Physical Address': (f'{rng.randint(1, 999)} {rng.choice(STREET_NAMES)} '
+                             f'{rng.choice(STREET_TYPES)}, {town}, MA {zip_code}'),
+        'Email Address': f'{first[0].lower()}{last.lower()}{rng.randint(1, 99)}@example.com',
+        'Cell Phone Number': phone,
+    }
+
+
+def generate_lists(data_dir, orgs=10, people_per_list=1000, overlap=0.3, typo_rate=0.02,
+                   missing_rate=0.2, seed=0, xlsx=False):
+    """ Write synthetic org lists to data_dir/output/org_NNN.csv (or data_dir/org_NNN.xlsx with
+        xlsx=True, to include convert_files) and the org names to org_names.txt.
+
+        overlap is the fraction of every list drawn from a shared pool of people (a shared person
+        is on about 3 lists on average), typo_rate the probability that a record has a typo in its
+        name or email and missing_rate the probability of every address, email and phone to be
+        empty.
+    """
+    import pandas as pd
+
+    rng = random.Random(seed)
+    target = os.path.join(data_dir, 'output')
+    os.makedirs(target, exist_ok=True)
+    shared = [random_person(rng) for _ in range(max(1, int(orgs * people_per_list * overlap / 3)))]
+
+    org_names = []
+    for org in range(orgs):
+        rows = []
+        for _ in range(people_per_list):
+            person = dict(rng.choice(shared) if rng.random() < overlap else random_person(rng))
+            if rng.random() < typo_rate:
+                col = rng.choice(['First Name', 'Last Name', 'Email Address'])
+                person[col] = typo(person[col], rng)
+            for col in ('Physical Address', 'Email Address', 'Cell Phone Number'):
+                if rng.random() < missing_rate:
+                    person[col] = ''
+            rows.append(person)
+
+        name = f'org_{org:03}'
+        org_names.append(name)
+        df = pd.DataFrame(rows)
+        if xlsx:
+            df.to_excel(os.path.join(data_dir, f'{name}.xlsx'), index=False)
+        else:
+            df.to_csv(os.path.join(target, f'{name}.csv'), index=False)
+    open(os.path.join(target, 'org_names.txt'), 'w').write('\n'.join(org_names))
+
+
+def run_stage(stage):
+    """Run a single stage in this process and print its measurements as json (see run_benchmark)"""
+    import main
+    from instrumentation import peak_rss_mb
+    start_rss = peak_rss_mb()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    STAGES[stage](main)
+    result = dict(stage=stage, seconds=time.perf_counter() - start,
+                  cpu_seconds=time.process_time() - cpu_start,
+                  start_rss_mb=start_rss, peak_rss_mb=peak_rss_mb())
+    print('BENCHMARK ' + json.dumps(result))
+
+
+def git_commit():
+    try:
+        repo_dir = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=repo_dir).stdout.strip()
+    except OSError:
+        return ''
+
+
+def run_benchmark(scales, orgs=10, overlap=0.3, typo_rate=0.02, missing_rate=0.2, stages=None,
+                  results_file='benchmark_results.jsonl', work_dir=None, seed=0):
+    """ Generate synthetic lists for every scale (people per list) and time every stage on them.
+        Every stage runs in a fresh process, so its peak memory isn't hidden by the stages before it.
+    """
+    stages = stages or list(STAGES)
+    work_dir = work_dir or tempfile.mkdtemp(prefix='cjp-benchmark-')
+    run = dict(time=datetime.now().isoformat(timespec='seconds'), commit=git_commit(), orgs=orgs,
+               overlap=overlap, typo_rate=typo_rate, missing_rate=missing_rate, seed=seed)
+
+    for people_per_list in scales:
+        data_dir = os.path.join(work_dir, f'{orgs}x{people_per_list}')
+        curr_time = datetime.now().strftime('%H:%M')
+        print(f'[{curr_time}] generating {orgs} lists x {people_per_list:,} people')
+        generate_lists(data_dir, orgs, people_per_list, overlap, typo_rate, missing_rate, seed)
+        env = dict(os.environ, CJP_INPUT_DIR=data_dir,
+                   CJP_TARGET_DIR=os.path.join(data_dir, 'output'))
+
+        for stage in stages:
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-stage', stage],
+                                  env=env, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(proc.stderr)
+                raise RuntimeError(f'stage {stage} failed at {people_per_list:,} people per list')
+            line = next(l for l in proc.stdout.splitlines() if l.startswith('BENCHMARK '))
+            result = dict(run, people_per_list=people_per_list, records=orgs * people_per_list,
+                          **json.loads(line[len('BENCHMARK '):]))
+            result['records_per_second'] = result['records'] / result['seconds']
+            peak = result['peak_rss_mb'] or 0
+            print(f"  {stage:<26} {result['seconds']:9.2f}s  peak {peak:8.1f} MB")
+            with open(results_file, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--people', type=int, nargs='+', default=[1000, 10000],
+                        help='people per list, one benchmark per value')
+    parser.add_argument('--orgs', type=int, default=10)
+    parser.add_argument('--overlap', type=float, default=0.3)
+    parser.add_argument('--typo-rate', type=float, default=0.02)
+    parser.add_argument('--missing-rate', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES))
+    parser.add_argument('--results', default='benchmark_results.jsonl')
+    parser.add_argument('--work-dir',
+                        help='where to write the synthetic lists (default: a temp dir)')
+    parser.add_argument('--run-stage', choices=list(STAGES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        run_stage(args.run_stage)
+        return
+    run_benchmark(args.people, args.orgs, args.overlap, args.typo_rate, args.missing_rate,
+                  args.stages, args.results, args.work_dir, args.seed)
+
+
+if __name__ == '__main__':
+    main()
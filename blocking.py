@@ -0,0 +1,31 @@
+import numpy as np
+from identity import connected_components
+
+
+def dedupe_blocks(last_name, email, cell_phone, prefix_len=3):
+    """ Split people into blocks that can be deduplicated on their own: records that share a last
+        name prefix, an email or a phone (all normalized) are in the same block, transitively.
+        Every match key of identity_keys() includes the email or the full name, so records that
+        merge_candidates merges are always in the same block.
+        Returns the block of every record (the index of its first record).
+    """
+    return connected_components(len(last_name), [
+        (last_name != '', last_name.str[:prefix_len]),
+        (email != '', email),
+        (cell_phone != '', cell_phone),
+    ])
+
+
+def split_blocks(blocks, n_chunks):
+    """ Pack blocks into at most n_chunks chunks of about the same number of records, biggest
+        blocks first. Returns the row positions of every chunk, in their original order.
+    """
+    block_ids, codes, sizes = np.unique(blocks, return_inverse=True, return_counts=True)
+    order = np.argsort(-sizes, kind='stable')
+    # Rows before every block, in packing order, decide its chunk
+    rows_before = np.cumsum(sizes[order]) - sizes[order]
+    chunk_of_block = np.empty(len(sizes), dtype=np.int64)
+    chunk_of_block[order] = np.minimum(rows_before * n_chunks // max(len(blocks), 1), n_chunks - 1)
+    chunk_of_row = chunk_of_block[codes]
+    chunks = [np.flatnonzero(chunk_of_row == c) for c in range(n_chunks)]
+    return [rows for rows in chunks if len(rows)]
@@ -0,0 +1,330 @@
+""" Command line entry point that runs the pipeline stages like make.
+
+    python cli.py                          run every stage that is out of date
+    python cli.py merge_candidates         run merge_candidates and the stale stages it needs
+    python cli.py --status                 show which stages are out of date and why
+    python cli.py --input-dir lists --set intermediate_format=parquet
+    python cli.py --profile merge_candidates   also save profile_merge_candidates.prof
+
+Every stage is fingerprinted by the content hash of its input files, the recorded outputs of the
+stages it depends on, its source code (its modules and every module of the repo they import) and
+its options. The fingerprints and the content hashes of
+the outputs of the last run are kept in pipeline_state_json. A stage runs again when its
+fingerprint changed or when one of its outputs was changed or deleted since.
+"""
+import argparse
+import ast
+from datetime import datetime
+from glob import glob
+import hashlib
+import json
+import os
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def stage_graph(pipeline, args):
+    """ The pipeline stages in run order. inputs and outputs are called when the stage is
+        checked, so they see the files written by the stages before it. code lists the modules
+        the stage runs, the modules they import are added by module_files.
+    """
+    import analytics
+    import config
+    import geography
+    import households
+    import minhash
+
+    def org_csv_files():
+        if not os.path.isfile(config.org_names_file):
+            return []
+        orgs = open(config.org_names_file).read().split('\n')
+        return [f'{config.target_dir}/{org}.csv' for org in orgs if org]
+
+    def workbooks():
+        return sorted(glob(f'{config.input_dir}/*.xlsx'))
+
+    def with_membership(path):
+        """A people csv and, with the sparse membership format, its membership file"""
+        if config.membership_format == 'sparse' and path.endswith('.csv'):
+            return [path, pipeline.membership_path(path)]
+        return [path]
+
+    parquet = config.intermediate_format == 'parquet'
+    people_orgs = config.people_orgs_parquet if parquet else config.all_people_json
+    all_people = config.all_people_parquet if parquet else config.all_people_csv
+    clean_people = config.clean_people_parquet if parquet else config.clean_people_csv
+    sparse = config.membership_format == 'sparse'
+    merged_people = (lambda: sorted(glob(f'{config.shards_dir}/shard_*.csv'))) if args.partitions \
+        else (lambda: [people_orgs])
+    # The people of a partitioned merge_files are read from the output of generate_output_file
+    merged_people_deps = ['merge_files'] + (['generate_output_file'] if args.partitions else [])
+
+    return [
+        dict(name='convert_files',
+             run=lambda: pipeline.convert_files(workers=args.workers),
+             deps=[], inputs=workbooks, code=['main.py', 'ingest.py', 'config.py'],
+             outputs=lambda: [f'{config.target_dir}/{os.path.basename(f)[:-5]}.csv'
+                              for f in workbooks()]),
+        dict(name='generate_org_list',
+             run=pipeline.generate_org_list,
+             deps=[], inputs=lambda: [], code=['main.py'],
+             params=lambda: [os.path.basename(f) for f in workbooks()],
+             outputs=lambda: [config.org_names_file]),
+        dict(name='merge_files',
+             run=lambda: pipeline.merge_files(partitions=args.partitions),
+             deps=['convert_files', 'generate_org_list'], inputs=org_csv_files,
+             code=['main.py', 'normalize.py'], params=lambda: [args.partitions, parquet],
+             outputs=lambda: merged_people() + [config.valid_orgs_file]),
+        dict(name='generate_output_file',
+             run=lambda: pipeline.generate_output_file(partitioned=bool(args.partitions)),
+             deps=['merge_files'], inputs=lambda: [], code=['main.py'],
+             params=lambda: [bool(args.partitions), parquet, sparse],
+             outputs=lambda: with_membership(all_people)),
+        dict(name='find_suspected_duplicates',
+             run=lambda: pipeline.find_suspected_duplicates(parallel=args.parallel,
+                                                            workers=args.workers),
+             deps=merged_people_deps, inputs=lambda: [],
+             code=['main.py', 'name_index.py', 'blocking.py'], params=lambda: [args.parallel],
+             outputs=lambda: [config.duplicates_json]),
+        dict(name='similar_contacts',
+             run=minhash.find_similar_contacts,
+             deps=merged_people_deps, inputs=lambda: [], code=['minhash.py'],
+             outputs=lambda: [config.similar_contacts_json]),
+        dict(name='clean',
+             run=lambda: pipeline.run_pipeline(pipeline.cleaning_stages),
+             deps=['generate_output_file'], inputs=lambda: [],
+             code=['main.py', 'address_parser.py'], params=lambda: [parquet, sparse],
+             outputs=lambda: with_membership(clean_people)),
+        dict(name='merge_candidates',
+             run=lambda: pipeline.merge_candidates(parallel=args.parallel, workers=args.workers),
+             deps=['clean'], inputs=lambda: [],
+             code=['main.py', 'identity.py', 'blocking.py'],
+             params=lambda: [args.parallel, sparse],
+             outputs=lambda: with_membership(config.final_merged_people_csv)),
+        dict(name='geography_cube',
+             run=geography.build_geography_cube,
+             deps=['merge_candidates'], inputs=lambda: [config.org_categories_csv],
+             code=['geography.py'], outputs=lambda: [config.geography_cube_npz]),
+        dict(name='overlap_report',
+             run=analytics.generate_overlap_report,
+             deps=['merge_candidates'], inputs=lambda: [], code=['analytics.py'],
+             outputs=lambda: [config.org_overlap_report_json]),
+        dict(name='org_reports',
+             run=lambda: analytics.generate_org_reports(workers=args.workers),
+             deps=['merge_candidates'], inputs=lambda: [config.org_categories_csv],
+             code=['analytics.py', 'geography.py'],
+             outputs=lambda: [os.path.join(config.org_reports_dir, 'benchmarks.json')]),
+        dict(name='households',
+             run=households.build_households,
+             deps=['merge_candidates'], inputs=lambda: [],
+             code=['households.py', 'address_parser.py'],
+             outputs=lambda: [config.households_npz]),
+        dict(name='household_overlap_report',
+             run=lambda: analytics.generate_overlap_report(households=True),
+             deps=['households'], inputs=lambda: [], code=['analytics.py'],
+             outputs=lambda: [config.household_overlap_report_json]),
+        dict(name='combinations_report',
+             run=lambda: analytics.generate_combinations_report(min_support=args.min_support),
+             deps=['merge_candidates'], inputs=lambda: [config.org_categories_csv],
+             code=['analytics.py', 'geography.py'], params=lambda: [args.min_support],
+             outputs=lambda: [config.org_combinations_json]),
+    ]
+
+
+def module_files(files):
+    """ files and the modules of the repo they import, directly or through other modules of the
+        repo, also inside functions
+    """
+    found = set()
+    pending = list(files)
+    while pending:
+        f = pending.pop()
+        if f in found:
+            continue
+        found.add(f)
+        for node in ast.walk(ast.parse(open(os.path.join(REPO_DIR, f), 'rb').read())):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                modules = [node.module]
+            else:
+                continue
+            for module in modules:
+                path = module.split('.')[0] + '.py'
+                if os.path.isfile(os.path.join(REPO_DIR, path)):
+                    pending.append(path)
+    return sorted(found)
+
+
+class PipelineState:
+    """Fingerprints and output hashes of the last run of every stage, and a cache of file hashes"""
+
+    def __init__(self, path):
+        self.path = path
+        state = json.load(open(path)) if os.path.isfile(path) else {}
+        self.stages = state.get('stages', {})
+        self.hashes = state.get('hashes', {})
+
+    def file_hash(self, path):
+        """Content hash of a file, None if it doesn't exist. Cached by size and mtime"""
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        cached = self.hashes.get(path)
+        if cached and (cached['size'], cached['mtime']) == (stat.st_size, stat.st_mtime_ns):
+            return cached['sha256']
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        self.hashes[path] = dict(size=stat.st_size, mtime=stat.st_mtime_ns, sha256=h.hexdigest())
+        return h.hexdigest()
+
+    def fingerprint(self, stage):
+        recorded = {dep: self.stages.get(dep, {}).get('outputs') for dep in stage['deps']}
+        fingerprint = dict(
+            code={f: self.file_hash(os.path.join(REPO_DIR, f))
+                  for f in module_files(stage['code'])},
+            inputs={f: self.file_hash(f) for f in stage['inputs']()},
+            deps=recorded,
+            params=stage.get('params', lambda: [])(),
+        )
+        return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+    def output_hashes(self, stage):
+        return {f: self.file_hash(f) for f in stage['outputs']()}
+
+    def record(self, stage, fingerprint):
+        self.stages[stage['name']] = dict(fingerprint=fingerprint,
+                                          outputs=self.output_hashes(stage),
+                                          finished=datetime.now().isoformat(timespec='seconds'))
+        self.save()
+
+    def save(self):
+        json.dump(dict(stages=self.stages, hashes=self.hashes), open(self.path, 'w'), indent=2)
+
+
+def changed_outputs(state, stages):
+    """ Stages with an output that was changed or deleted since it was last written. A file written
+        by several stages is checked against the last of them, and then all of them have to run
+        again.
+    """
+    last_writer = {}
+    for stage in stages:
+        if stage['name'] in state.stages:
+            for f, digest in state.stages[stage['name']]['outputs'].items():
+                last_writer[f] = digest
+    changed = set()
+    for stage in stages:
+        recorded = state.stages.get(stage['name'])
+        if recorded and any(state.file_hash(f) != last_writer[f] for f in recorded['outputs']):
+            changed.add(stage['name'])
+    return changed
+
+
+def required_stages(stages, targets, with_deps=True):
+    by_name = {stage['name']: stage for stage in stages}
+    required = set()
+
+    def require(name):
+        if name not in required:
+            required.add(name)
+            if with_deps:
+                for dep in by_name[name]['deps']:
+                    require(dep)
+
+    for name in targets or by_name:
+        require(name)
+    return [stage for stage in stages if stage['name'] in required]
+
+
+def run(stages, state, targets=None, with_deps=True, force=False, dry_run=False):
+    """ Run the stale stages needed for targets (all stages by default), in order. dry_run only
+        lists them, with the stages after a stale stage it depends on as stale too, since running
+        it would change their fingerprints.
+    """
+    changed = changed_outputs(state, stages)
+    stale = set()
+    for stage in required_stages(stages, targets, with_deps):
+        name = stage['name']
+        fingerprint = state.fingerprint(stage)
+        recorded = state.stages.get(name)
+        if force and name in (targets or [name]):
+            reason = 'forced'
+        elif recorded is None:
+            reason = 'never run'
+        elif name in changed:
+            reason = 'outputs changed'
+        elif recorded['fingerprint'] != fingerprint:
+            reason = 'inputs or code changed'
+        elif dry_run and stale.intersection(stage['deps']):
+            reason = 'dependency stale'
+        else:
+            print(f'{name:<26} up to date')
+            continue
+
+        curr_time = datetime.now().strftime('%H:%M')
+        print(f'[{curr_time}] {name:<26} {"stale" if dry_run else "running"} ({reason})')
+        if dry_run:
+            stale.add(name)
+            continue
+        stage['run']()
+        # The stages after this one see its new outputs in their fingerprints
+        state.record(stage, fingerprint)
+        changed.discard(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('targets', nargs='*', metavar='stage',
+                        help='stages to bring up to date (default: all)')
+    parser.add_argument('--status', action='store_true',
+                        help='show the stale stages without running them')
+    parser.add_argument('--force', action='store_true', help='run the target stages even if '
+                                                             'they are up to date')
+    parser.add_argument('--no-deps', action='store_true',
+                        help="don't run the stale stages the targets depend on")
+    parser.add_argument('--input-dir', help='overrides config.input_dir (and target_dir)')
+    parser.add_argument('--target-dir', help='overrides config.target_dir')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a config.py setting, e.g. intermediate_format=parquet')
+    parser.add_argument('--partitions', type=int,
+                        help='merge out of core in this many shards (see merge_files)')
+    parser.add_argument('--parallel', action='store_true',
+                        help='dedupe and merge blocks of people across a process pool')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--min-support', type=float, default=0.01,
+                        help='smallest share of multi-list people for combinations_report')
+    parser.add_argument('--profile', action='append', default=[], metavar='STAGE',
+                        help='run this @instrument function (e.g. merge_candidates or '
+                             'run_pipeline) under cProfile, see instrumentation.py')
+    args = parser.parse_args()
+
+    # config.py derives every path from the directories when it is imported, so they are set
+    # before anything imports it
+    if args.input_dir:
+        os.environ['CJP_INPUT_DIR'] = args.input_dir
+    if args.target_dir:
+        os.environ['CJP_TARGET_DIR'] = args.target_dir
+    import config
+    for setting in args.set:
+        name, _, value = setting.partition('=')
+        if not hasattr(config, name):
+            parser.error(f'unknown config setting: {name}')
+        setattr(config, name, value)
+    import instrumentation
+    instrumentation.profile_stages.update(args.profile)
+    import main as pipeline
+
+    stages = stage_graph(pipeline, args)
+    unknown = set(args.targets) - {stage['name'] for stage in stages}
+    if unknown:
+        parser.error(f'unknown stages: {", ".join(sorted(unknown))}')
+    os.makedirs(config.target_dir, exist_ok=True)
+    state = PipelineState(config.pipeline_state_json)
+    run(stages, state, args.targets, not args.no_deps, args.force, args.status)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import os
 import sys
 
 if sys.platform == 'darwin':
@@ -7,23 +8,48 @@ else:
     input_dir = r'C:/Users/Liat Sayfan/Documents/CJP Contact Lists'
     target_dir = input_dir + '/output'
 
+# Both directories can be overridden with environment variables (used by benchmark.py)
+if 'CJP_INPUT_DIR' in os.environ:
+    input_dir = os.environ['CJP_INPUT_DIR']
+    target_dir = input_dir + '/output'
+target_dir = os.environ.get('CJP_TARGET_DIR', target_dir)
+
 
 org_names_file = target_dir + '/org_names.txt'
 valid_orgs_file = target_dir + '/valid_orgs.txt'
+convert_manifest_json = target_dir + '/convert_manifest.json'
 all_people_json = target_dir + '/all_people.json'
 all_people_csv = target_dir + '/all_people.csv'
 duplicates_json = target_dir + '/duplicates.json'
+similar_contacts_json = target_dir + '/similar_contacts.json'
 merge_candidates_json = target_dir + '/merge_candidates.json'
 final_merged_people_csv = target_dir + '/final_merged_people.csv'
+address_cache_db = target_dir + '/address_cache.sqlite'
+org_overlap_report_json = target_dir + '/org_overlap_report.json'
+household_overlap_report_json = target_dir + '/household_overlap_report.json'
+org_reports_dir = target_dir + '/org_reports'
+org_combinations_json = target_dir + '/org_combinations.json'
+identity_index_db = target_dir + '/identity_index.sqlite'
+run_report_json = target_dir + '/run_report.json'
+pipeline_state_json = target_dir + '/pipeline_state.json'
+geography_cube_npz = target_dir + '/geography_cube.npz'
+households_npz = target_dir + '/households.npz'
+# Org categories (synagogues, schools, ...): a csv with Org and Category columns
+org_categories_csv = input_dir + '/org_categories.csv'
 
-dtype_dict = {
-    'First Name': str,
-    'Last Name': str,
-    'Physical Address': str,
-    'Email Address': str,
-    'Cell Phone Number': str,
-    'Zip Code': str
-}
+# Format of the intermediate files passed between stages: 'csv' (all_people.json and
+# all_people.csv) or 'parquet' (needs pyarrow). With 'parquet', csv is only written on export.
+intermediate_format = 'csv'
+people_orgs_parquet = target_dir + '/people_orgs.parquet'
+all_people_parquet = target_dir + '/all_people.parquet'
+# The people table after the cleaning stages (see run_pipeline), the input of merge_candidates
+clean_people_csv = target_dir + '/clean_people.csv'
+clean_people_parquet = target_dir + '/clean_people.parquet'
+# Shards of the out-of-core mode of merge_files / generate_output_file
+shards_dir = target_dir + '/shards'
+# Org membership in all_people.csv and final_merged_people.csv: 'dense' (a 0/1 column per org) or
+# 'sparse' (only the orgs of every person, in {name}_membership.npz next to the csv file)
+membership_format = 'dense'
 
 col_list = [
     'First Name',
@@ -32,6 +58,18 @@ col_list = [
     'Email Address',
     'Cell Phone Number']
 
+# Other headers org lists use for the col_list columns, matched whatever their case, spacing and
+# punctuation (see ingest.py)
+header_aliases = {
+    'First Name': ['First', 'FirstName', 'Given Name', 'FName'],
+    'Last Name': ['Last', 'LastName', 'Surname', 'Family Name', 'LName'],
+    'Physical Address': ['Address', 'Street Address', 'Home Address', 'Mailing Address',
+                         'Address 1', 'Address1'],
+    'Email Address': ['Email', 'E-mail', 'E-mail Address', 'Email Addresses', 'Primary Email'],
+    'Cell Phone Number': ['Cell', 'Cell Phone', 'Cell Number', 'Mobile', 'Mobile Phone',
+                          'Mobile Number', 'Phone', 'Phone Number'],
+}
+
 # Using middle dot (alt-shift-9 on Mac, Num Lock on + alt-0183 on Windows - use numeric keypad)
 # as a separator
 key_separator = '·'
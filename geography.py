@@ -0,0 +1,158 @@
+""" Geographic distribution of the merged people per org, per org category and across all lists.
+
+    build_geography_cube counts the unique people of final_merged_people.csv per zip code and org,
+    per zip code and category and per zip code over all lists, and saves the counts with an index
+    from every zip code to the rows of its people in geography_cube_npz. Every person has one zip
+    code, so zip3 counts are sums of zip counts and any slice of the cube is read from these
+    arrays without going back to the people table.
+
+    cube = GeographyCube.load()
+    cube.counts('zip3', category='Synagogues')   # people per zip3 on any synagogue list
+    cube.counts('zip', org='org_017')             # people per zip code on one list
+    cube.people('02458')                          # rows of final_merged_people.csv in 02458
+"""
+from datetime import datetime
+import os
+import numpy as np
+import pandas as pd
+from config import final_merged_people_csv, geography_cube_npz, org_categories_csv
+from main import read_people_membership, split_columns
+
+UNCATEGORIZED = 'Uncategorized'
+
+
+def load_org_categories(orgs, path=org_categories_csv):
+    """ Category of every org from org_categories_csv (columns Org and Category). Orgs that are
+        missing from it are UNCATEGORIZED.
+    """
+    categories = {}
+    if os.path.isfile(path):
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        categories = dict(zip(df['Org'].str.strip(), df['Category'].str.strip()))
+    return [categories.get(org) or UNCATEGORIZED for org in orgs]
+
+
+def category_membership(org_categories, membership):
+    """ people x categories uint8 matrix, 1 where a person is on any org of the category, for a
+        people x orgs membership matrix. Returns (categories, category of every org, matrix).
+    """
+    categories, org_category = np.unique(org_categories, return_inverse=True)
+    matrix = np.zeros((len(membership), len(categories)), dtype=np.uint8)
+    for c in range(len(categories)):
+        matrix[:, c] = membership[:, org_category == c].any(axis=1)
+    return categories, org_category, matrix
+
+
+def count_by_zip(zip_ids, n_zips, membership):
+    """zips x columns counts of the people with a 1 in every column of a people x columns matrix"""
+    people, cols = membership.nonzero()
+    n_cols = membership.shape[1]
+    counts = np.bincount(zip_ids[people] * n_cols + cols, minlength=n_zips * n_cols)
+    return counts.reshape(n_zips, n_cols).astype(np.uint32)
+
+
+class GeographyCube:
+    """ Unique people per zip code x org, zip code x category and zip code over all lists, with the
+        rows of every zip code as a CSR index (the rows of zip i are
+        person_rows[zip_offsets[i]:zip_offsets[i + 1]]). People without a zip code are under ''.
+    """
+
+    def __init__(self, zips, orgs, categories, org_category, org_counts, category_counts,
+                 total_counts, zip_offsets, person_rows):
+        self.zips = zips
+        self.orgs = orgs
+        self.categories = categories
+        self.org_category = org_category
+        self.org_counts = org_counts
+        self.category_counts = category_counts
+        self.total_counts = total_counts
+        self.zip_offsets = zip_offsets
+        self.person_rows = person_rows
+        self.zip_ids = {z: i for i, z in enumerate(zips)}
+        self.org_ids = {o: i for i, o in enumerate(orgs)}
+        self.category_ids = {c: i for i, c in enumerate(categories)}
+
+    @classmethod
+    def build(cls, zip_codes, orgs, membership, org_categories):
+        """zip_codes and membership (people x orgs, 0/1) are in the row order of the people table"""
+        zip_ids, zips = pd.factorize(pd.Series(zip_codes), sort=True)
+        zip_ids = zip_ids.astype(np.int64)
+        # A person on several lists of a category counts once for that category
+        categories, org_category, by_category = category_membership(org_categories, membership)
+
+        person_rows = np.argsort(zip_ids, kind='stable').astype(np.int32)
+        zip_offsets = np.zeros(len(zips) + 1, dtype=np.int64)
+        zip_offsets[1:] = np.cumsum(np.bincount(zip_ids, minlength=len(zips)))
+        on_any_list = membership.any(axis=1)
+        return cls(np.asarray(zips, dtype=str), np.asarray(orgs, dtype=str), categories,
+                   org_category, count_by_zip(zip_ids, len(zips), membership),
+                   count_by_zip(zip_ids, len(zips), by_category),
+                   np.bincount(zip_ids[on_any_list], minlength=len(zips)).astype(np.uint32),
+                   zip_offsets, person_rows)
+
+    def zip3_ids(self):
+        zip3s, ids = np.unique([z[:3] for z in self.zips], return_inverse=True)
+        return zip3s, ids
+
+    def counts(self, level='zip', org=None, category=None):
+        """ Unique people per zip code (level='zip') or per first 3 digits of the zip code
+            (level='zip3'), on one org, on any org of one category or, by default, on any list
+        """
+        if org is not None:
+            values = self.org_counts[:, self.org_ids[org]]
+        elif category is not None:
+            values = self.category_counts[:, self.category_ids[category]]
+        else:
+            values = self.total_counts
+        if level == 'zip':
+            return pd.Series(values, index=self.zips, name='people')
+        if level != 'zip3':
+            raise ValueError(f'unknown level: {level}')
+        zip3s, ids = self.zip3_ids()
+        return pd.Series(np.bincount(ids, weights=values, minlength=len(zip3s)).astype(np.int64),
+                         index=zip3s, name='people')
+
+    def table(self, level='zip', by='org'):
+        """All the counts of a level as one zips x orgs (by='org') or zips x categories table"""
+        values, columns = ((self.org_counts, self.orgs) if by == 'org'
+                           else (self.category_counts, self.categories))
+        df = pd.DataFrame(values, index=self.zips, columns=columns)
+        if level == 'zip3':
+            zip3s, ids = self.zip3_ids()
+            df = df.groupby(ids).sum().set_axis(zip3s)
+        return df
+
+    def people(self, zip_code):
+        """Rows (0 based, without the header) of the people of a zip code in the people table"""
+        i = self.zip_ids.get(zip_code)
+        if i is None:
+            return np.array([], dtype=np.int32)
+        return self.person_rows[self.zip_offsets[i]:self.zip_offsets[i + 1]]
+
+    def save(self, path=geography_cube_npz):
+        np.savez_compressed(path, zips=self.zips, orgs=self.orgs, categories=self.categories,
+                            org_category=self.org_category, org_counts=self.org_counts,
+                            category_counts=self.category_counts, total_counts=self.total_counts,
+                            zip_offsets=self.zip_offsets, person_rows=self.person_rows)
+
+    @classmethod
+    def load(cls, path=geography_cube_npz):
+        with np.load(path) as arrays:
+            return cls(**{name: arrays[name] for name in arrays.files})
+
+
+def build_geography_cube(path=final_merged_people_csv):
+    """Build the geography cube of the merged people table and save it to geography_cube_npz"""
+    contact_cols = split_columns(pd.read_csv(path, nrows=0).columns)[0]
+    if 'Zip Code' not in contact_cols:
+        raise ValueError(f'{path} has no Zip Code column, run update_zip_code first')
+    zip_codes = pd.read_csv(path, usecols=['Zip Code'], dtype=str, keep_default_na=False)
+    orgs, membership = read_people_membership(path)
+    print(f'[{datetime.now().strftime("%H:%M")}] {len(membership):,} people x {len(orgs):,} orgs')
+
+    cube = GeographyCube.build(zip_codes['Zip Code'].to_numpy(), orgs, membership,
+                               load_org_categories(orgs))
+    cube.save()
+    print(f'Geography cube created: {len(cube.zips):,} zip codes, '
+          f'{len(cube.categories):,} categories:', geography_cube_npz)
+    return cube
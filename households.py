@@ -0,0 +1,85 @@
+""" Households of the merged people.
+
+    People share a household when their addresses have the same household key: the house number,
+    street (with its directions and street type), unit and zip code (the city when there is no zip
+    code) of the parsed address. Formatting variants ('St' / 'Street', 'North' / 'N', '#3B' /
+    'Apt 3b', upper / lower case) get the same key.
+    build_households assigns a household id to every row of final_merged_people.csv (people
+    without a usable address are households of their own) and rolls their org membership up to a
+    households x orgs matrix, so every metric of analytics.py can be reported per household.
+"""
+from datetime import datetime
+import re
+import numpy as np
+import pandas as pd
+from address_parser import parse_addresses, street_address
+from config import final_merged_people_csv, households_npz, key_separator
+from main import read_people_membership, split_columns
+
+NON_ALPHANUMERIC = re.compile(r'[^a-z0-9]+')
+
+
+def household_key(components, zip_code):
+    """ Household key of a parsed address, '' when it has no house number or street name. The
+        street keeps its directions and abbreviated type (see address_parser.street_address), so
+        '12 N Main St' / '12 S Main St' and '12 Main St' / '12 Main Ave' are different households.
+    """
+    if not components or not components.get('StreetName', '').strip():
+        return ''
+    number, street, _ = (NON_ALPHANUMERIC.sub(' ', part).strip()
+                         for part in street_address(components))
+    unit, place = (NON_ALPHANUMERIC.sub(' ', components.get(label, '').lower()).strip()
+                   for label in ('OccupancyIdentifier', 'PlaceName'))
+    if not (number and street):
+        return ''
+    return key_separator.join((number, street, unit.replace(' ', ''), zip_code or place))
+
+
+def assign_households(keys):
+    """ Household id of every person from their household keys: people with the same key share an
+        id, people without a key get an id of their own. Returns (ids, key of every household).
+    """
+    keys = pd.Series(keys, dtype=object)
+    ids, unique_keys = pd.factorize(keys.where(keys != ''))
+    no_key = ids == -1
+    ids[no_key] = len(unique_keys) + np.arange(no_key.sum())
+    return ids, np.concatenate([np.asarray(unique_keys, dtype=str), np.full(no_key.sum(), '')])
+
+
+def household_membership(household_ids, n_households, membership):
+    """households x orgs uint8 matrix: 1 where any person of the household is on the org"""
+    if len(household_ids) == 0:
+        return np.zeros((0, membership.shape[1]), dtype=np.uint8)
+    order = np.argsort(household_ids, kind='stable')
+    sizes = np.bincount(household_ids, minlength=n_households)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    return np.maximum.reduceat(membership[order], starts, axis=0)
+
+
+def build_households(path=final_merged_people_csv):
+    """Assign a household to every merged person and save the households to households_npz"""
+    contact_cols = split_columns(pd.read_csv(path, nrows=0).columns)[0]
+    address_cols = ['Physical Address'] + (['Zip Code'] if 'Zip Code' in contact_cols else [])
+    df = pd.read_csv(path, usecols=address_cols, dtype=str, keep_default_na=False)
+    zip_codes = df['Zip Code'] if 'Zip Code' in df.columns else pd.Series('', index=df.index)
+    org_cols, membership = read_people_membership(path)
+    print(f'[{datetime.now().strftime("%H:%M")}] {len(df):,} people x {len(org_cols):,} orgs')
+
+    parsed = parse_addresses(df['Physical Address'])
+    keys = [household_key(c, z) for c, z in zip(parsed, zip_codes)]
+    household_ids, household_keys = assign_households(keys)
+    membership = household_membership(household_ids, len(household_keys), membership)
+
+    np.savez_compressed(households_npz, orgs=np.asarray(org_cols, dtype=str),
+                        household_ids=household_ids.astype(np.int32), keys=household_keys,
+                        people=np.bincount(household_ids, minlength=len(household_keys)),
+                        membership=membership)
+    print('Households:', f'{len(household_keys):,}', '- on more than one list:',
+          f'{(membership.sum(axis=1) > 1).sum():,}')
+    print('Households created:', households_npz)
+
+
+def load_household_membership(path=households_npz):
+    """(org names, households x orgs uint8 matrix), like analytics.load_membership for people"""
+    with np.load(path) as households:
+        return list(households['orgs']), households['membership']
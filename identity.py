@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+from config import key_separator
+
+
+class DisjointSet:
+    """Union-find over record indices. The root of every set is its smallest index, so the root of
+       a cluster is always the first record of that cluster in the input order.
+    """
+
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            # Path halving keeps the trees flat without a second pass
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i == root_j:
+            return root_i
+        if root_j < root_i:
+            root_i, root_j = root_j, root_i
+        self.parent[root_j] = root_i
+        return root_i
+
+
+def identity_keys(first_name, last_name, email, address, cell_phone):
+    """Return the match keys of a person according to the merge rules in the README. Two records
+       that share any of these keys are the same person. All fields are expected to be normalized
+       (stripped and lower case) with missing values as ''.
+    """
+    keys = []
+    has_full_name = first_name and last_name
+    if email:
+        if has_full_name:
+            keys.append(key_separator.join(('name+email', first_name, last_name, email)))
+        keys.append(key_separator.join(('email+first name', first_name, email)))
+    if has_full_name and address:
+        keys.append(key_separator.join(('name+address', first_name, last_name, address)))
+    if has_full_name and cell_phone:
+        keys.append(key_separator.join(('name+phone', first_name, last_name, cell_phone)))
+    if has_full_name and not (email or address or cell_phone):
+        # Nothing but a name to go on, only merged with other records that have nothing but a name
+        keys.append(key_separator.join(('name only', first_name, last_name)))
+    return keys
+
+
+def resolve_identities(people):
+    """ Link the records of the same person transitively in one pass.
+
+        people is a sequence of (first name, last name, email, address, cell phone) tuples.
+        Returns a list with the cluster root (index of the first record of the cluster) of every
+        record.
+    """
+    people = list(people)
+    clusters = DisjointSet(len(people))
+    first_seen = {}
+    for i, fields in enumerate(people):
+        for key in identity_keys(*fields):
+            j = first_seen.setdefault(key, i)
+            if j != i:
+                clusters.union(j, i)
+    return [clusters.find(i) for i in range(len(people))]
+
+
+def resolve_identities_vectorized(first_name, last_name, email, address, cell_phone):
+    """ Same as resolve_identities() for whole columns (pandas Series of normalized strings)"""
+    sep = key_separator
+    has_full_name = (first_name != '') & (last_name != '')
+    has_email, has_address, has_phone = email != '', address != '', cell_phone != ''
+    name = first_name + sep + last_name
+    return connected_components(len(first_name), [
+        (has_full_name & has_email, name + sep + email),
+        (has_email, first_name + sep + email),
+        (has_full_name & has_address, name + sep + address),
+        (has_full_name & has_phone, name + sep + cell_phone),
+        (has_full_name & ~(has_email | has_address | has_phone), name),
+    ])
+
+
+def connected_components(n, key_kinds):
+    """ Cluster n records that share a key. key_kinds is a list of (mask, keys) Series pairs, only
+        the records where mask is True have a key of that kind.
+
+        Every key kind is factorized into group codes once, then every record takes the smallest
+        label in each of its groups until nothing changes. At that point the label of every record
+        is the index of the first record of its cluster, exactly like DisjointSet roots.
+    """
+    groups = []
+    for mask, keys in key_kinds:
+        mask = np.asarray(mask)
+        codes, uniques = pd.factorize(keys[mask])
+        groups.append((np.flatnonzero(mask), codes, len(uniques)))
+
+    labels = np.arange(n)
+    changed = True
+    while changed:
+        changed = False
+        for idx, codes, n_groups in groups:
+            group_min = np.full(n_groups, n)
+            np.minimum.at(group_min, codes, labels[idx])
+            new_labels = group_min[codes]
+            update = new_labels < labels[idx]
+            if update.any():
+                labels[idx[update]] = new_labels[update]
+                changed = True
+        # Pointer jumping, the label of a label is in the same cluster and never larger
+        while True:
+            jumped = labels[labels]
+            if (jumped == labels).all():
+                break
+            labels = jumped
+    return labels
@@ -0,0 +1,255 @@
+from datetime import datetime
+import json
+import os
+import sqlite3
+import pandas as pd
+from config import (
+    target_dir,
+    org_names_file,
+    valid_orgs_file,
+    identity_index_db
+)
+from identity import identity_keys
+from normalize import normalize_people
+from main import cleaning_stages, read_all_people_file, split_columns, write_merged_people
+
+contact_cols = ['First Name', 'Last Name', 'Physical Address', 'Zip Code', 'Email Address',
+                'Cell Phone Number']
+name_cols = ['First Name', 'Last Name']
+
+
+def read_field(value):
+    return str(value).lower()
+
+
+class IdentityIndex:
+    """ Persistent version of the merge in merge_candidates that new lists can be added to.
+
+        Every match key (see identity_keys) points to the cluster of the people that have it.
+        Clusters are identified by the sequence number of their first record and linked with a
+        union-find, like the records in resolve_identities. Every cluster keeps its merged record:
+        the name of its first record, the first non-empty value of every other field (with the
+        sequence number of the record it came from) and the set of its org ids.
+
+        The keys, the union-find parents and the clusters are rows of identity_index_db. They are
+        read when a record needs them and only the rows that changed are written back by save(),
+        so adding a record only reads and writes the clusters of its keys, whatever the size of
+        the index.
+    """
+
+    def __init__(self, path=identity_index_db, orgs=None):
+        """Open the index in path, or create a new, empty one with these orgs"""
+        if orgs is not None and os.path.isfile(path):
+            os.remove(path)
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS orgs (id INTEGER PRIMARY KEY, name TEXT);
+            CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, record INTEGER);
+            CREATE TABLE IF NOT EXISTS parents (record INTEGER PRIMARY KEY, parent INTEGER);
+            CREATE TABLE IF NOT EXISTS clusters (root INTEGER PRIMARY KEY, fields TEXT, orgs TEXT);
+        """)
+        self.orgs = [name for name, in self.db.execute('SELECT name FROM orgs ORDER BY id')]
+        self.stored_orgs = len(self.orgs)
+        query = 'SELECT COALESCE(MAX(record) + 1, 0) FROM parents'
+        self.records = self.stored_records = self.db.execute(query).fetchone()[0]
+        self.size = self.db.execute('SELECT COUNT(*) FROM clusters').fetchone()[0]
+        # Rows read or changed since the index was opened, and which of them changed
+        self.keys, self.parent, self.clusters = {}, {}, {}
+        self.changed_keys, self.changed_parents = set(), set()
+        self.changed_clusters, self.removed_clusters = set(), set()
+        for org in orgs or []:
+            self.add_org(org)
+
+    def __len__(self):
+        return self.size
+
+    def load_keys(self, keys):
+        """Read the records of many keys at once (a lookup per key is slower)"""
+        keys = [k for k in set(keys) if k not in self.keys]
+        # Stay below the sqlite limit on the number of query parameters
+        for i in range(0, len(keys), 900):
+            chunk = keys[i:i + 900]
+            params = ','.join('?' * len(chunk))
+            query = f'SELECT key, record FROM keys WHERE key IN ({params})'
+            self.keys.update(self.db.execute(query, chunk))
+
+    def key_record(self, key):
+        if key not in self.keys:
+            if not self.stored_records:
+                return None
+            row = self.db.execute('SELECT record FROM keys WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.keys[key] = row[0]
+        return self.keys[key]
+
+    def get_parent(self, i):
+        if i not in self.parent:
+            query = 'SELECT parent FROM parents WHERE record = ?'
+            self.parent[i] = self.db.execute(query, (i,)).fetchone()[0]
+        return self.parent[i]
+
+    def cluster(self, root):
+        if root not in self.clusters:
+            query = 'SELECT fields, orgs FROM clusters WHERE root = ?'
+            fields, orgs = self.db.execute(query, (root,)).fetchone()
+            fields = {col: tuple(value) for col, value in json.loads(fields).items()}
+            self.clusters[root] = dict(fields=fields, orgs=set(json.loads(orgs)))
+        return self.clusters[root]
+
+    def find(self, i):
+        while True:
+            parent = self.get_parent(i)
+            if parent == i:
+                return i
+            grandparent = self.get_parent(parent)
+            if grandparent != parent:
+                self.parent[i] = grandparent
+                self.changed_parents.add(i)
+            i = grandparent
+
+    def add_org(self, org):
+        self.orgs.append(org)
+        return len(self.orgs) - 1
+
+    def add(self, person, org_ids):
+        """Add a record (dict of contact columns) that is on the lists with the given org ids"""
+        i = self.records
+        self.records += 1
+        self.size += 1
+        self.parent[i] = i
+        self.changed_parents.add(i)
+        self.clusters[i] = dict(
+            fields={col: (i, person[col]) for col in contact_cols
+                    if col in name_cols or person[col] != ''},
+            orgs=set(int(org_id) for org_id in org_ids))
+        self.changed_clusters.add(i)
+
+        for key in person_keys(person):
+            j = self.key_record(key)
+            if j is None:
+                self.keys[key] = i
+                self.changed_keys.add(key)
+            else:
+                self.union(j, i)
+
+    def union(self, i, j):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i == root_j:
+            return
+        if root_j < root_i:
+            root_i, root_j = root_j, root_i
+        self.parent[root_j] = root_i
+        self.changed_parents.add(root_j)
+        first, other = self.cluster(root_i), self.cluster(root_j)
+        del self.clusters[root_j]
+        self.changed_clusters.discard(root_j)
+        self.removed_clusters.add(root_j)
+        self.size -= 1
+        for col, (seq, value) in other['fields'].items():
+            current = first['fields'].get(col)
+            if current is None or (col not in name_cols and seq < current[0]):
+                first['fields'][col] = (seq, value)
+        first['orgs'] |= other['orgs']
+        self.changed_clusters.add(root_i)
+
+    def people(self):
+        """The merged records ordered by their first record, as lists of values (see export())"""
+        self.save()
+        query = 'SELECT fields, orgs FROM clusters ORDER BY root'
+        for fields, orgs in self.db.execute(query):
+            fields, orgs = json.loads(fields), set(json.loads(orgs))
+            orgs = [1 if i in orgs else 0 for i in range(len(self.orgs))]
+            values = [fields[col][1] if col in fields else '' for col in contact_cols]
+            yield values + orgs + [sum(orgs)]
+
+    def save(self):
+        """Write the rows that changed since the index was opened or last saved"""
+        with self.db:
+            self.db.executemany('INSERT INTO orgs VALUES (?, ?)',
+                                enumerate(self.orgs[self.stored_orgs:], start=self.stored_orgs))
+            self.db.executemany('INSERT OR REPLACE INTO keys VALUES (?, ?)',
+                                ((key, self.keys[key]) for key in self.changed_keys))
+            self.db.executemany('INSERT OR REPLACE INTO parents VALUES (?, ?)',
+                                ((i, self.parent[i]) for i in self.changed_parents))
+            self.db.executemany('DELETE FROM clusters WHERE root = ?',
+                                ((root,) for root in self.removed_clusters))
+            self.db.executemany('INSERT OR REPLACE INTO clusters VALUES (?, ?, ?)',
+                                ((root, json.dumps(self.clusters[root]['fields']),
+                                  json.dumps(sorted(self.clusters[root]['orgs'])))
+                                 for root in self.changed_clusters))
+        self.stored_orgs, self.stored_records = len(self.orgs), self.records
+        self.changed_keys, self.changed_parents = set(), set()
+        self.changed_clusters, self.removed_clusters = set(), set()
+
+
+def person_keys(person):
+    """The match keys of a record (dict of contact columns), see identity_keys"""
+    return identity_keys(*(read_field(person[col]) for col in
+                           ['First Name', 'Last Name', 'Email Address', 'Physical Address',
+                            'Cell Phone Number']))
+
+
+def build_identity_index():
+    """Build the identity index from the cleaned people table (the input of merge_candidates)"""
+    all_people = read_all_people_file(clean=True)
+    all_people, org_cols = prepare_people(all_people)
+    index = IdentityIndex(orgs=org_cols)
+    memberships = all_people[org_cols].to_numpy(dtype='uint8')
+    for i, person in enumerate(all_people[contact_cols].to_dict('records')):
+        if i % 10000 == 0:
+            curr_time = datetime.now().strftime('%H:%M')
+            print(f"[{curr_time}] {i:,} / {len(all_people):,}")
+        index.add(person, memberships[i].nonzero()[0])
+    print('People in index:', f'{len(index):,}')
+    index.save()
+
+
+def prepare_people(all_people):
+    org_cols = split_columns(all_people.columns)[1]
+    for col in contact_cols:
+        if col not in all_people.columns:
+            all_people[col] = ''
+    return all_people, org_cols
+
+
+def add_org_list(org):
+    """ Merge a single new org list ({target_dir}/{org}.csv, see convert_files) into the identity
+        index. The list is cleaned with the same stages as the people table and only the people on
+        it are looked up and updated, so this takes time in proportion to the size of the list.
+    """
+    index = IdentityIndex()
+    if org in index.orgs:
+        print('Org already in the index:', org)
+        return
+
+    df = pd.read_csv(f'{target_dir}/{org}.csv', dtype=str, keep_default_na=False)
+    if not {'First Name', 'Last Name'}.issubset(df.columns):
+        print('Org list without First Name and Last Name:', org)
+        return
+
+    people = normalize_people(df).drop_duplicates(ignore_index=True)
+    for stage in cleaning_stages:
+        people = stage(people)
+    people = prepare_people(people)[0]
+
+    org_id = index.add_org(org)
+    people_before = len(index)
+    people = people[contact_cols].to_dict('records')
+    index.load_keys(key for person in people for key in person_keys(person))
+    for person in people:
+        index.add(person, [org_id])
+    print(f'Processing org: {org}, {len(people):,} records, '
+          f'{len(index) - people_before:,} new people')
+
+    index.save()
+    for orgs_file in (org_names_file, valid_orgs_file):
+        if os.path.isfile(orgs_file):
+            orgs = open(orgs_file).read().split('\n')
+            open(orgs_file, 'w').write('\n'.join(orgs + [org]))
+
+
+def export_identity_index():
+    """Write final_merged_people.csv from the identity index"""
+    index = IdentityIndex()
+    write_merged_people(contact_cols, index.orgs, index.people())
@@ -0,0 +1,99 @@
+""" Conversion of an org workbook to csv in one streaming pass over its first sheet.
+
+    The header row is mapped onto col_list with header_aliases ('E-mail' -> 'Email Address',
+    'Mobile' -> 'Cell Phone Number', ...) and the schema of the list is checked while its rows are
+    written, so nothing has to read the list again to find out whether it can be merged.
+"""
+import csv
+from datetime import date, datetime
+import re
+from openpyxl import load_workbook
+from config import col_list, header_aliases
+
+NON_ALPHANUMERIC = re.compile(r'[^a-z0-9]+')
+REQUIRED_COLUMNS = ['First Name', 'Last Name']
+
+
+def header_key(header):
+    """'E-Mail ' -> 'e mail', so aliases match whatever the case, spacing and punctuation"""
+    return NON_ALPHANUMERIC.sub(' ', str(header).lower()).strip()
+
+
+alias_columns = {header_key(alias): col for col, aliases in header_aliases.items()
+                 for alias in [col] + aliases}
+
+
+def map_headers(headers):
+    """ Return the headers of a sheet with the headers of the col_list columns renamed to them. A
+        column is taken by the header that is the column itself (whatever its case and spacing)
+        and otherwise by the first of its aliases, so 'Phone' is only 'Cell Phone Number' when
+        there is no 'Cell Phone Number' header. The other headers keep their name, made unique.
+    """
+    headers = ['' if header is None else str(header).strip() for header in headers]
+    keys = [header_key(header) for header in headers]
+    mapped = [None] * len(headers)
+    for exact in (True, False):
+        for i, key in enumerate(keys):
+            col = alias_columns.get(key)
+            is_column = col is not None and key == header_key(col)
+            if col and mapped[i] is None and col not in mapped and is_column == exact:
+                mapped[i] = col
+
+    used = set(mapped)
+    for i, header in enumerate(headers):
+        if mapped[i] is None:
+            name = unique = header or f'Unnamed: {i}'
+            n = 1
+            while unique in used:
+                n += 1
+                unique = f'{name} ({n})'
+            used.add(unique)
+            mapped[i] = unique
+    return mapped
+
+
+def cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        # Phone numbers and zip codes typed as numbers, without the '.0' of a float
+        return str(int(value))
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def convert_workbook(xlsx_file, csv_file):
+    """ Stream the first sheet of xlsx_file to csv_file, one row at a time, with its headers mapped
+        onto col_list. Returns the schema of the list: its original and mapped headers, the
+        col_list columns it is missing, its number of rows and whether it has the columns
+        merge_files needs.
+    """
+    workbook = load_workbook(xlsx_file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        headers = list(next(rows, ()))
+        # Read-only sheets can report empty columns after the last header
+        while headers and headers[-1] is None:
+            headers.pop()
+        columns = map_headers(headers)
+        n_rows = 0
+        with open(csv_file, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for row in rows:
+                values = [cell_text(v) for v in row[:len(columns)]]
+                if not any(v.strip() for v in values):
+                    continue
+                writer.writerow(values + [''] * (len(columns) - len(values)))
+                n_rows += 1
+    finally:
+        workbook.close()
+
+    return dict(
+        headers=['' if h is None else str(h) for h in headers],
+        columns=columns,
+        missing=[col for col in col_list if col not in columns],
+        rows=n_rows,
+        valid=all(col in columns for col in REQUIRED_COLUMNS),
+    )
@@ -0,0 +1,113 @@
+""" Timings, throughput and peak memory of every pipeline stage.
+
+    Functions decorated with @instrument record their wall time, CPU time, rows in and out, rows
+    per second and peak RSS. The records of the run are written to run_report_json after every
+    top level stage. Stages named in profile_stages are also run under cProfile and their stats
+    are dumped to {target_dir}/profile_{stage}.prof (open with python -m pstats or snakeviz).
+"""
+import cProfile
+from datetime import datetime
+from functools import wraps
+import json
+import os
+import sys
+import time
+import pandas as pd
+from config import target_dir, run_report_json
+
+profile_stages = set()
+
+_run = dict(started=datetime.now().isoformat(timespec='seconds'), argv=sys.argv, stages=[])
+_stack = []
+
+
+def reset_peak_rss():
+    """Reset the peak RSS of this process (Linux only). Returns False where it isn't possible"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None when it can't be measured"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kB on Linux, bytes on macOS
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    except (ImportError, AttributeError):
+        return None
+
+
+def report_rows(rows_in=None, rows_out=None):
+    """Set the rows in and/or out of the stage that is running (for stages that work on files)"""
+    if not _stack:
+        return
+    if rows_in is not None:
+        _stack[-1]['rows_in'] = rows_in
+    if rows_out is not None:
+        _stack[-1]['rows_out'] = rows_out
+
+
+def write_run_report(path=None):
+    with open(path or run_report_json, 'w') as f:
+        json.dump(_run, f, indent=2)
+
+
+def instrument(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        stage = dict(stage=func.__name__, depth=len(_stack),
+                     started=datetime.now().isoformat(timespec='seconds'), rows_in=None,
+                     rows_out=None)
+        if args and isinstance(args[0], pd.DataFrame):
+            stage['rows_in'] = len(args[0])
+        _stack.append(stage)
+        # A nested stage can't reset the peak without hiding it from the stage around it
+        per_stage_peak = len(_stack) == 1 and reset_peak_rss()
+        profiler = cProfile.Profile() if func.__name__ in profile_stages else None
+
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            if profiler:
+                result = profiler.runcall(func, *args, **kwargs)
+            else:
+                result = func(*args, **kwargs)
+            if isinstance(result, pd.DataFrame):
+                stage['rows_out'] = len(result)
+        except BaseException:
+            stage['failed'] = True
+            raise
+        finally:
+            _stack.pop()
+            stage['seconds'] = time.perf_counter() - start
+            stage['cpu_seconds'] = time.process_time() - cpu_start
+            rows = stage['rows_in'] if stage['rows_in'] is not None else stage['rows_out']
+            if rows is not None and stage['seconds'] > 0:
+                stage['rows_per_second'] = rows / stage['seconds']
+            stage['peak_rss_mb'] = peak_rss_mb()
+            stage['peak_rss_is_per_stage'] = per_stage_peak
+            if profiler:
+                stage['profile'] = os.path.join(target_dir, f'profile_{func.__name__}.prof')
+                profiler.dump_stats(stage['profile'])
+            _run['stages'].append(stage)
+            if not _stack:
+                write_run_report()
+        return result
+
+    return wrapper
@@ -1,44 +1,130 @@
 import csv
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
+from functools import partial
+import hashlib
+import heapq
 import json
 import os
+import shutil
 import time
-from collections import defaultdict, OrderedDict
+from collections import defaultdict
 from glob import glob
+from itertools import chain, islice
 from pprint import pprint as pp
 import numpy as np
 import pandas as pd
-import usaddress
-from pyxdameraulevenshtein import damerau_levenshtein_distance
+from address_parser import canonical_address, parse_addresses, extract_zip_code
+from blocking import dedupe_blocks, split_blocks
+from ingest import convert_workbook
+from identity import resolve_identities, resolve_identities_vectorized
+from instrumentation import instrument, report_rows
+from name_index import NameIndex
+from normalize import normalize_people, normalize_zip_codes
 from config import (
     col_list,
     input_dir,
     target_dir,
     org_names_file,
     valid_orgs_file,
+    convert_manifest_json,
+    header_aliases,
     all_people_json,
     all_people_csv,
     duplicates_json,
     key_separator,
-    merge_candidates_json, dtype_dict, final_merged_people_csv
+    merge_candidates_json, final_merged_people_csv,
+    intermediate_format,
+    membership_format,
+    people_orgs_parquet,
+    all_people_parquet,
+    clean_people_csv,
+    clean_people_parquet,
+    shards_dir
 )
 
+try:
+    import pyarrow  # noqa: F401
+    # Arrow strings keep a column in one buffer instead of a Python object per value
+    string_dtype = 'string[pyarrow]'
+except ImportError:
+    string_dtype = 'category'
 
-def convert_files():
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def convert_file(xlsx_file, csv_file):
+    # Only the first sheet, streamed row by row (see ingest.py)
+    return csv_file, convert_workbook(xlsx_file, csv_file)
+
+
+@instrument
+def convert_files(workers=None):
+    """ Convert new or changed xlsx files to csv across a process pool.
+        convert_manifest_json keeps the size, mtime and content hash of every converted workbook,
+        the mtime of its csv and a hash of the header_aliases it was converted with. A workbook is
+        converted again when its content changed (a list re-sent with the same file name), when
+        its csv is missing or was changed since or when header_aliases changed.
+        The schema of every list (headers, missing columns, rows) is checked during the conversion
+        and kept in the manifest too.
+    """
     os.makedirs(target_dir, exist_ok=True)
-    # Read file list from target directory (*.xlsx)
+    manifest = {}
+    if os.path.isfile(convert_manifest_json):
+        manifest = json.load(open(convert_manifest_json))
+
+    aliases = hashlib.sha256(json.dumps(header_aliases, sort_keys=True).encode()).hexdigest()
+
+    # Read file list from input directory (*.xlsx)
     files = glob(f'{input_dir}/*.xlsx')
+    pending = []
     for f in files:
         base_name = os.path.basename(f)
-        csv_file = f'{input_dir}/output/{base_name.replace(".xlsx", ".csv")}'
-        if os.path.isfile(csv_file):
+        csv_file = f'{target_dir}/{base_name.replace(".xlsx", ".csv")}'
+        stat = os.stat(f)
+        entry = manifest.get(base_name)
+        csv_is_current = (entry is not None and os.path.isfile(csv_file) and
+                          os.path.getmtime(csv_file) == entry['csv_mtime'] and
+                          entry.get('aliases') == aliases)
+        if csv_is_current and (entry['size'], entry['mtime']) == (stat.st_size, stat.st_mtime):
             continue
-        sheets = pd.read_excel(f, sheet_name=None)  # Returns a dictionary of DataFrames
-        df = list(sheets.values())[0]  # Save each sheet as a CSV
-        print('converting:', csv_file)
-        df.to_csv(csv_file, index=False)
-
-
+        digest = file_hash(f)
+        if csv_is_current and digest == entry['sha256']:
+            # Touched but not changed
+            entry['mtime'] = stat.st_mtime
+            continue
+        pending.append((f, csv_file, dict(size=stat.st_size, mtime=stat.st_mtime, sha256=digest,
+                                          aliases=aliases)))
+
+    for base_name in set(manifest) - {os.path.basename(f) for f in files}:
+        print('workbook no longer exists:', base_name)
+        del manifest[base_name]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(convert_file, f, csv_file): (f, entry)
+                   for f, csv_file, entry in pending}
+        for future in as_completed(futures):
+            f, entry = futures[future]
+            csv_file, schema = future.result()
+            print('converted:', csv_file)
+            if not schema['valid']:
+                print('  missing', ', '.join(schema['missing']), '- columns:', schema['headers'])
+            entry['csv_mtime'] = os.path.getmtime(csv_file)
+            entry['schema'] = schema
+            manifest[os.path.basename(f)] = entry
+            # Save after every workbook so an interrupted run keeps what it converted
+            json.dump(manifest, open(convert_manifest_json, 'w'), indent=2)
+
+    json.dump(manifest, open(convert_manifest_json, 'w'), indent=2)
+
+
+@instrument
 def generate_org_list():
     files = glob(f'{input_dir}/*.xlsx')
     org_list = []
@@ -49,29 +135,121 @@ def generate_org_list():
     open(org_names_file, 'w').write(s)
 
 
-def merge_files():
+@instrument
+def merge_files(partitions=None, chunksize=100_000):
     """Merge all files where each row contains all the personal details for each person and
       which organization lists that person appeared on (marked as 0=not on that org list or 1=yes on
       that org list.
+      Orgs are kept as their position in valid_orgs_file (their org id), not their names.
+      Contact fields are normalized once here (see normalize.py), every later stage uses them as
+      they are.
+      With partitions, the files are streamed in chunks into that many on-disk shards instead of
+      being merged in memory (see merge_files_partitioned).
     """
+    if partitions:
+        return merge_files_partitioned(partitions, chunksize)
+
     min_col_set = {'First Name', 'Last Name'}
     orgs = open(org_names_file).read().split('\n')
 
     all_people = defaultdict(list)
     valid_orgs = []
+    records = 0
     for org in orgs:
-        df = pd.read_csv(f'{input_dir}/output/{org}.csv').fillna('').astype(str)
+        df = pd.read_csv(f'{target_dir}/{org}.csv', dtype=str, keep_default_na=False)
         if not min_col_set.issubset(set(df.columns)):
             continue
 
         print('Processing org:', org)
+        org_id = len(valid_orgs)
         valid_orgs.append(org)
-        for index, row in df.iterrows():
-            key = key_separator.join(row.get(col, '') for col in col_list)
-            all_people[key].append(org)
+        records += len(df)
+        for key in person_keys(normalize_people(df)):
+            all_people[key].append(org_id)
 
     open(valid_orgs_file, 'w').write("\n".join(valid_orgs))
-    json.dump(all_people, open(all_people_json, 'w'))
+    write_people_orgs(all_people)
+    report_rows(rows_in=records, rows_out=len(all_people))
+
+
+def merge_files_partitioned(partitions, chunksize):
+    """ Out-of-core merge_files: every org csv is read in chunks and every record is appended as
+        (sequence number, key, org id) to one of `partitions` shards in shards_dir, by the hash of
+        its key. All the records of a person end up in the same shard, so generate_output_file can
+        then merge every shard on its own. Memory is bounded by the chunk size.
+    """
+    min_col_set = {'First Name', 'Last Name'}
+    orgs = open(org_names_file).read().split('\n')
+
+    shutil.rmtree(shards_dir, ignore_errors=True)
+    os.makedirs(shards_dir)
+    # The people are only in the shards until generate_output_file, the output of an earlier
+    # in-memory merge must not be read instead (see read_people_orgs)
+    for path in (all_people_json, people_orgs_parquet):
+        if os.path.isfile(path):
+            os.remove(path)
+    valid_orgs = []
+    records = 0
+    for org in orgs:
+        org_file = f'{target_dir}/{org}.csv'
+        if not min_col_set.issubset(set(pd.read_csv(org_file, nrows=0).columns)):
+            continue
+
+        print('Processing org:', org)
+        org_id = len(valid_orgs)
+        valid_orgs.append(org)
+        for df in pd.read_csv(org_file, dtype=str, keep_default_na=False, chunksize=chunksize):
+            keys = person_keys(normalize_people(df))
+            shard = pd.DataFrame({'seq': np.arange(records, records + len(df)),
+                                  'key': keys.to_numpy(), 'org_id': org_id})
+            records += len(df)
+            partition = pd.util.hash_pandas_object(shard['key'], index=False).to_numpy() % partitions
+            for p, rows in shard.groupby(partition):
+                rows.to_csv(f'{shards_dir}/shard_{p:04}.csv', mode='a', header=False, index=False)
+
+    open(valid_orgs_file, 'w').write("\n".join(valid_orgs))
+    report_rows(rows_in=records)
+
+
+def person_keys(people):
+    """The merge_files key of every person: the col_list fields joined by key_separator"""
+    keys = people[col_list[0]]
+    for col in col_list[1:]:
+        keys = keys + key_separator + people[col]
+    return keys
+
+
+def write_people_orgs(all_people):
+    """Save the dictionary of person details -> org list created by merge_files"""
+    if intermediate_format == 'parquet':
+        df = pd.DataFrame([k.split(key_separator) for k in all_people], columns=col_list)
+        df['Orgs'] = list(all_people.values())
+        df.to_parquet(people_orgs_parquet, index=False)
+    else:
+        json.dump(all_people, open(all_people_json, 'w'))
+
+
+def read_people_orgs(columns=None):
+    """ Load the output of merge_files as a DataFrame with the col_list columns + an 'Orgs' column
+        with the list of org ids (see merge_files) of every person. After
+        merge_files(partitions=...) they are read from the people table of generate_output_file,
+        in the same order.
+    """
+    if not os.path.isfile(people_orgs_parquet if intermediate_format == 'parquet'
+                          else all_people_json):
+        if columns is not None and 'Orgs' not in columns:
+            return read_all_people_file(columns=columns)[columns].astype(object)
+        all_people = read_all_people_file()
+        df = all_people[col_list].astype(object)
+        membership = all_people[split_columns(all_people.columns)[1]].to_numpy()
+        df['Orgs'] = [np.flatnonzero(orgs).tolist() for orgs in membership]
+        return df if columns is None else df[columns]
+    if intermediate_format == 'parquet':
+        return pd.read_parquet(people_orgs_parquet, columns=columns)
+    all_people = json.load(open(all_people_json))
+    df = pd.DataFrame([k.split(key_separator) for k in all_people], columns=col_list)
+    df['Orgs'] = list(all_people.values())
+    return df if columns is None else df[columns]
 
 
 # def standardize_names(rows):
@@ -91,84 +269,195 @@ def merge_files():
 #                 p[1] = person[1]
 
 
-def generate_output_file():
+@instrument
+def generate_output_file(partitioned=False):
     """ Create a DataFrame from the dictionary where the columns the details of a person + all org
         names and the values are 0 or 1 depending on whether the person is on that org list
+        The org columns are built as one uint8 matrix and Total Orgs is the number of its set flags.
+        partitioned=True builds it from the shards of merge_files(partitions=...) instead (see
+        generate_output_file_partitioned).
     """
-    all_people = json.load(open(all_people_json))
-    valid_orgs = open(org_names_file).read().split('\n')
-    cols = col_list + valid_orgs + ['Total Orgs']
+    if partitioned:
+        return generate_output_file_partitioned()
 
-    # Accumulate rows in a list to avoid repeated appending
-    rows = []
+    all_people = read_people_orgs()
+    valid_orgs = open(valid_orgs_file).read().split('\n')
     total_people = len(all_people)
 
-    for i, (k, v) in enumerate(all_people.items(), start=1):
-        if i % 10000 == 0:
-            curr_time = datetime.now().strftime('%H:%M')
-            print(f"[{curr_time}] {i:,} / {total_people:,}, {i * 100 / total_people:.2f}% complete")
-
-        row = k.split(key_separator) + [1 if org in v else 0 for org in valid_orgs] + [len(v)]
-        rows.append(row)
+    org_counts = all_people['Orgs'].map(len).to_numpy()
+    people = np.repeat(np.arange(total_people), org_counts)
+    org_ids = np.fromiter(chain.from_iterable(all_people['Orgs']), dtype=np.int64,
+                          count=org_counts.sum())
+    membership = np.zeros((total_people, len(valid_orgs)), dtype=np.uint8)
+    membership[people, org_ids] = 1
 
     #rows2 = standardize_names(rows)
-    # Convert the accumulated rows to a DataFrame at once
-    df = pd.DataFrame(rows, columns=cols)
+    df = pd.concat([all_people[col_list], pd.DataFrame(membership, columns=valid_orgs)], axis=1)
+    df['Total Orgs'] = membership.sum(axis=1, dtype=np.int32)
 
-    # Clean up the phone numbers and emails
-    phones = df['Cell Phone Number'].str.replace(r'[-() ]+', '', regex=True).str.replace('nan', '')
-    emails = df['Email Address'].str.replace('nan', '')
-    df['Cell Phone Number'] = phones
-    df['Email Address'] = emails
+    write_all_people_file(df)
+    report_rows(rows_in=total_people, rows_out=len(df))
 
-    df.to_csv(all_people_csv, index=False)
+
+def generate_output_file_partitioned():
+    """ Merge every shard written by merge_files_partitioned on its own, then stream the shards into
+        all_people.csv in the order people were first seen, which gives the same file as
+        merge_files() + generate_output_file(). Memory is bounded by the size of a shard.
+        The output is all_people.parquet with the parquet intermediate format (written in row
+        groups, see write_parquet_batches) and a dense all_people.csv otherwise, whatever the
+        membership format.
+    """
+    valid_orgs = open(valid_orgs_file).read().split('\n')
+    cols = col_list + valid_orgs + ['Total Orgs']
+    shards = sorted(glob(f'{shards_dir}/shard_*.csv'))
+
+    parts = []
+    total_people = 0
+    for i, shard_file in enumerate(shards, start=1):
+        curr_time = datetime.now().strftime('%H:%M')
+        print(f"[{curr_time}] shard {i:,} / {len(shards):,}")
+        shard = pd.read_csv(shard_file, names=['seq', 'key', 'org_id'],
+                            dtype={'key': str, 'org_id': np.int32}, keep_default_na=False)
+        codes, keys = pd.factorize(shard['key'])
+        first_seq = np.full(len(keys), np.iinfo(np.int64).max)
+        np.minimum.at(first_seq, codes, shard['seq'].to_numpy())
+        membership = np.zeros((len(keys), len(valid_orgs)), dtype=np.uint8)
+        membership[codes, shard['org_id'].to_numpy()] = 1
+
+        df = pd.DataFrame(list(keys.str.split(key_separator)), columns=col_list)
+        df = pd.concat([df, pd.DataFrame(membership, columns=valid_orgs)], axis=1)
+        df['Total Orgs'] = membership.sum(axis=1, dtype=np.int32)
+        df.insert(0, 'seq', first_seq)
+        part_file = shard_file.replace('shard_', 'part_')
+        df.sort_values('seq').to_csv(part_file, header=False, index=False)
+        parts.append(part_file)
+        total_people += len(df)
+
+    files = [open(part, newline='', encoding='utf-8') for part in parts]
+    rows = (row[1:] for row in heapq.merge(*(csv.reader(f) for f in files),
+                                            key=lambda r: int(r[0])))
+    if intermediate_format == 'parquet':
+        write_parquet_batches(rows, cols, all_people_parquet)
+    else:
+        with open(all_people_csv, 'w', newline='', encoding='utf-8') as out:
+            writer = csv.writer(out, lineterminator=os.linesep)
+            writer.writerow(cols)
+            writer.writerows(rows)
+    for f, part in zip(files, parts):
+        f.close()
+        os.remove(part)
+    report_rows(rows_out=total_people)
+
+
+def write_parquet_batches(rows, cols, path, batch_size=100_000):
+    """ Write rows of csv fields to a parquet file with the column types of people_dtypes, one row
+        group of batch_size rows at a time, so the rows never have to be in memory together
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    dtypes = people_dtypes(cols)
+    writer = None
+    for batch in iter(lambda: list(islice(rows, batch_size)), []):
+        table = pa.Table.from_pandas(pd.DataFrame(batch, columns=cols).astype(dtypes),
+                                     preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(path, table.schema)
+        writer.write_table(table)
+    if writer is None:
+        pd.DataFrame(columns=cols).astype(dtypes).to_parquet(path, index=False)
+    else:
+        writer.close()
 
 
 def list_org_columns():
-    """List orgs that don't have at least 'First Name' and 'Last Name' columns"""
+    """ List orgs that don't have at least 'First Name' and 'Last Name' columns, from the schemas
+        convert_files recorded (only the header of lists that weren't converted is read)
+    """
     orgs = open(org_names_file).read().split('\n')
+    manifest = {}
+    if os.path.isfile(convert_manifest_json):
+        manifest = json.load(open(convert_manifest_json))
     min_cols = {'First Name', 'Last Name'}
     for org in orgs:
-        df = pd.read_csv(f'{input_dir}/output/{org}.csv')
-        cols = set(list(df.columns))
-        if cols.issuperset(min_cols):
+        schema = manifest.get(f'{org}.xlsx', {}).get('schema')
+        if schema is not None:
+            cols, valid = schema['headers'], schema['valid']
+        else:
+            cols = list(pd.read_csv(f'{target_dir}/{org}.csv', nrows=0).columns)
+            valid = min_cols.issubset(cols)
+        if valid:
             continue
-        print(org, ':', list(df.columns))
+        print(org, ':', cols)
         print('-' * 10)
 
-def find_matching_name(all_names, name):
-    for n in all_names:
-        if damerau_levenshtein_distance(n, name) < 3:
-            return n
-    return name
-
-def find_suspected_duplicates():
-    all_people = [p.split(key_separator) for p in json.load(open(all_people_json)).keys()]
-
-    # Process fields to remove leading/trailing spaces and convert to lowercase
-    all_people = [[field.strip().lower() for field in person] for person in all_people]
-
-    # Create 3 dictionaries where the keys are first name + last name, email address, phone number
-    all_by_name = defaultdict(list)
-    all_by_email = defaultdict(list)
-    all_by_phone = defaultdict(list)
-
-    for p in all_people:
-        name = f'{p[0]} {p[1]}'
-        name = find_matching_name(all_by_name.keys(), name)
-        all_by_name[name].append(p)
-        all_by_email[p[3]].append(p)
-        all_by_phone[p[4]].append(p)
-
-    invalid_phone_values = ['', 'none', 'y', 'no call', 'null, null', 'x', 'nocall']
-    invalid_email_values = ['', 'none', 'nan', 'n/a']
-
-
+def find_matching_name(name_index, name):
+    """Return the first indexed name with edit distance < 3 from name, or add name to the index"""
+    match = name_index.find(name)
+    if match is None:
+        name_index.add(name)
+        return name
+    return match
+
+def group_duplicates(people, positions):
+    """ Group people (lists of lower case fields) by similar name, email and phone number.
+        Returns a dict per grouping of key -> [first position, [(position, person), ...]]
+    """
+    by_name, by_email, by_phone = {}, {}, {}
+    name_index = NameIndex(max_distance=2)
+    for pos, p in zip(positions, people):
+        name = find_matching_name(name_index, f'{p[0]} {p[1]}')
+        for groups, key in ((by_name, name), (by_email, p[3]), (by_phone, p[4])):
+            groups.setdefault(key, [pos, []])[1].append((pos, p))
+    return by_name, by_email, by_phone
+
+
+@instrument
+def find_suspected_duplicates(parallel=False, workers=None):
+    """ Find people that may be on the lists more than once: people with similar names (edit
+        distance < 3), the same email or the same phone number.
+        parallel=True splits people into blocks (see blocking.py) and groups every block in a
+        process pool. Email and phone groups are the same, similar names are only found within a
+        block (when they share the first letters of the last name).
+    """
+    all_people = read_people_orgs(columns=col_list).values.tolist()
+    report_rows(rows_in=len(all_people))
+
+    # Fields are normalized by merge_files, only names need case folding (see group_duplicates)
+    all_people = [[field.lower() for field in person] for person in all_people]
+
+    if parallel:
+        last_name, email, phone = (pd.Series([p[i] for p in all_people]) for i in (1, 3, 4))
+        blocks = dedupe_blocks(last_name, email, phone)
+        chunks = split_blocks(blocks, (workers or os.cpu_count()) * 4)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(group_duplicates, [all_people[i] for i in rows],
+                                       rows.tolist())
+                       for rows in chunks]
+            results = [future.result() for future in futures]
+    else:
+        results = [group_duplicates(all_people, range(len(all_people)))]
+
+    # Stitch the groups of all blocks in the order of their first person, like a single pass
+    grouped = []
+    for groups in zip(*results):
+        stitched = {}
+        for block_groups in groups:
+            for key, (first, members) in block_groups.items():
+                if key in stitched:
+                    stitched[key][0] = min(stitched[key][0], first)
+                    stitched[key][1].extend(members)
+                else:
+                    stitched[key] = [first, members]
+        grouped.append({key: [p for pos, p in sorted(members, key=lambda m: m[0])]
+                        for key, (first, members) in sorted(stitched.items(),
+                                                            key=lambda item: item[1][0])})
+    all_by_name, all_by_email, all_by_phone = grouped
+
+    # Placeholder emails and phones are already '' (see normalize.py)
     all_by_name = {k: v for k, v in all_by_name.items() if len(v) > 1}
-    all_by_email = {k: v for k, v in all_by_email.items() if
-                    k not in invalid_email_values and len(v) > 1}
-    all_by_phone = {k: v for k, v in all_by_phone.items() if
-                    k not in invalid_phone_values and len(v) > 1}
+    all_by_email = {k: v for k, v in all_by_email.items() if k and len(v) > 1}
+    all_by_phone = {k: v for k, v in all_by_phone.items() if k and len(v) > 1}
 
     all_duplicates = dict(by_name=all_by_name, by_email=all_by_email, by_phone=all_by_phone)
 
@@ -180,349 +469,352 @@ def find_suspected_duplicates():
     json.dump(all_duplicates, open(duplicates_json, 'w'), indent=2)
 
 
-def update_org_count_per_person():
-    all_people = pd.read_csv(all_people_csv)
-    all_people['Total Orgs'] = all_people[all_people.columns[5:]].sum(axis=1)
-    all_people.to_csv(all_people_csv, index=False)
+@instrument
+def update_org_count_per_person(all_people):
+    contact_cols, org_cols = split_columns(all_people.columns)
+    all_people['Total Orgs'] = all_people[org_cols].to_numpy(dtype=np.uint8).sum(axis=1,
+                                                                                dtype=np.int32)
+    return all_people
 
 
-def update_zip_code():
-    def extract_zip_code(address):
-        try:
-            parsed_address = usaddress.tag(str(address))
-            components = parsed_address[0]
-            zip_code = components.get('ZipCode', '').split('-')[0].strip()
-            return zip_code.zfill(5) if zip_code else ''
-        except usaddress.RepeatedLabelError:
-            return ''
+@instrument
+def update_zip_code(all_people):
+    """ Set Zip Code to the zip code of Physical Address. An existing zip code is kept when the
+        address has none, so running it again doesn't lose zip codes.
+    """
+    parsed = parse_addresses(all_people['Physical Address'])
+    zip_code = normalize_zip_codes(parsed.map(extract_zip_code))
+    if 'Zip Code' in all_people.columns:
+        existing = all_people['Zip Code'].astype(str)
+        all_people['Zip Code'] = zip_code.where(zip_code != '', existing)
+        return all_people
 
-    all_people = read_all_people_file()
-    zip_code = all_people['Physical Address'].apply(extract_zip_code).astype(str)
     all_people['Zip Code'] = zip_code
-
     cols = list(all_people.columns)
     physical_address_index = cols.index('Physical Address')
 
     cols = cols[:physical_address_index + 1] + ['Zip Code'] + cols[physical_address_index + 1:-1]
-    all_people = all_people[cols]
-
-    all_people.to_csv(all_people_csv, index=False)
-
-
-def clean_addresses():
-    def clean_address(address):
-        def abbrev_state(state_name):
-            d = {
-                'Alabama': 'AL',
-                'Alaska': 'AK',
-                'Arizona': 'AZ',
-                'Arkansas': 'AR',
-                'California': 'CA',
-                'Colorado': 'CO',
-                'Connecticut': 'CT',
-                'Delaware': 'DE',
-                'District of Columbia': 'DC',
-                'Florida': 'FL',
-                'Georgia': 'GA',
-                'Hawaii': 'HI',
-                'Idaho': 'ID',
-                'Illinois': 'IL',
-                'Indiana': 'IN',
-                'Iowa': 'IA',
-                'Kansas': 'KS',
-                'Kentucky': 'KY',
-                'Louisiana': 'LA',
-                'Maine': 'ME',
-                'Maryland': 'MD',
-                'Massachusetts': 'MA',
-                'Michigan': 'MI',
-                'Minnesota': 'MN',
-                'Mississippi': 'MS',
-                'Missouri': 'MO',
-                'Montana': 'MT',
-                'Nebraska': 'NE',
-                'Nevada': 'NV',
-                'New Hampshire': 'NH',
-                'New Jersey': 'NJ',
-                'New Mexico': 'NM',
-                'New York': 'NY',
-                'North Carolina': 'NC',
-                'North Dakota': 'ND',
-                'Ohio': 'OH',
-                'Oklahoma': 'OK',
-                'Oregon': 'OR',
-                'Pennsylvania': 'PA',
-                'Rhode Island': 'RI',
-                'South Carolina': 'SC',
-                'South Dakota': 'SD',
-                'Tennessee': 'TN',
-                'Texas': 'TX',
-                'Utah': 'UT',
-                'Vermont': 'VT',
-                'Virginia': 'VA',
-                'Washington': 'WA',
-                'West Virginia': 'WV',
-                'Wisconsin': 'WI',
-                'Wyoming': 'WY'
-            }
-
-            return d.get(state_name.title(), 'MA')
-
-        try:
-            parsed_address = usaddress.tag(str(address))
-            c = parsed_address[0]
-            address = ' '.join((c.get('AddressNumber', ''), c.get('StreetName', ''),
-            c.get('StreetNamePostType'),
-                               c.get('PlaceName', ''), abbrev_state(c.get('StateName')))).lower()
-        except Exception:
-            return address.lower()
-
-    all_people = read_all_people_file()
-    all_people['Physical Address'].apply(clean_address).astype(str)
-
-    all_people.to_csv(all_people_csv, index=False)
-
-
-def clean_phone_numbers():
-    all_people = read_all_people_file()
-    phone_numbers = (all_people['Cell Phone Number']
-                     .astype(str)
-                     .str.replace(r'[-() ]', '', regex=True)
-                     .str.replace('nan', '')
-                     .str.replace('+', ''))
-    all_people['Cell Phone Number'] = phone_numbers
-    all_people.to_csv(all_people_csv, index=False)
-
-
-def clean_nans(cols):
-    all_people = read_all_people_file()
-    for col in cols:
-        values = all_people[col].astype(str).str.replace('nan', '')
-        all_people[col] = values
-    all_people.to_csv(all_people_csv, index=False)
-
-
-def read_all_people_file():
-    df = pd.read_csv(all_people_csv, dtype=dtype_dict, low_memory=False).astype(str)
-    return df
-
-
-def merge_candidates():
-    def merge_people_with_same_name_and_email(d: dict, col_names):
-        people1 = []
-        for candidates in d.values():
-            p = OrderedDict()
-            first = candidates[0]
-            # find all valid values if exist per field of each candidate
-            addresses = [c[2] for c in candidates if c[2]]
-            zipcodes = [c[3] for c in candidates if c[3]]
-            phones = [c[5] for c in candidates if c[5]]
-            address1 = addresses[0] if addresses else ''
-            # Populate the person's details
-            p['First Name'] = first[0]
-            p['Last Name'] = first[1]
-            p['Physical Address'] = f'''"{address1}"'''
-            p['Zip Code'] = zipcodes[0] if zipcodes else ''
-            p['Email Address'] = first[4]
-            p['Cell Phone Number'] = phones[0] if phones else ''
-            # Populate orgs
-            total = 0
-            for i in range(6, len(first) - 1):
-                member = max([int(c[i]) for c in candidates])
-                total += member
-                p[col_names[i]] = member
-
-            p['Total Orgs'] = total
-            people1.append(list(p.values()))
-        return people1
-
-    def merge_people_with_same_email_and_no_name(d: dict, col_names):
-        people2 = []
-        for candidates in d.values():
-            p = OrderedDict()
-            first = candidates[0]
-            # find all valid values if exist per field of each candidate
-            addresses = [c[2] for c in candidates if c[2]]
-            zipcodes = [c[3] for c in candidates if c[3]]
-            phones = [c[5] for c in candidates if c[5]]
-            address2 = addresses[0] if addresses else ''
-            # Populate the person's details
-            p['First Name'] = first[0]
-            p['Last Name'] = first[1]
-            p['Physical Address'] = f'''"{address2}"'''
-            p['Zip Code'] = zipcodes[0] if zipcodes else ''
-            p['Email Address'] = first[4]
-            p['Cell Phone Number'] = phones[0] if phones else ''
-            # Populate orgs
-            total = 0
-            for i in range(6, len(first) - 1):
-                member = max([int(c[i]) for c in candidates])
-                total += member
-                p[col_names[i]] = member
-
-            p['Total Orgs'] = total
-            people2.append(list(p.values()))
-        return people2
-
-    def merge_people_with_same_name_and_address(d: dict, col_names):
-        people3 = []
-        for candidates in d.values():
-            p = OrderedDict()
-            first = candidates[0]
-            # find all valid values if exist per field of each candidate
-            zipcodes = [c[3] for c in candidates if c[3]]
-            phones = [c[5] for c in candidates if c[5]]
-            emails = [c[4] for c in candidates if c[4]]
-            # Populate the person's details
-            p['First Name'] = first[0]
-            p['Last Name'] = first[1]
-            p['Physical Address'] = f'"{first[2]}"'
-            p['Zip Code'] = zipcodes[0] if zipcodes else ''
-            p['Email Address'] = emails[0] if emails else ''
-            p['Cell Phone Number'] = phones[0] if phones else ''
-            # Populate orgs
-            total = 0
-            for i in range(6, len(first) - 1):
-                member = max([int(c[i]) for c in candidates])
-                total += member
-                p[col_names[i]] = member
-
-            p['Total Orgs'] = total
-            people3.append(list(p.values()))
-        return people3
-
-    def merge_people_with_same_name_and_cell_phone(d: dict, col_names):
-        people4 = []
-        for candidates in d.values():
-            p = OrderedDict()
-            first = candidates[0]
-            # find all valid values if exist per field of each candidate
-            addresses = [c[2] for c in candidates if c[2]]
-            zipcodes = [c[3] for c in candidates if c[3]]
-            emails = [c[4] for c in candidates if c[4]]
-            address4 = addresses[0] if addresses else ''
-            # Populate the person's details
-            p['First Name'] = first[0]
-            p['Last Name'] = first[1]
-            p['Physical Address'] = f'''"{address4}"'''
-            p['Zip Code'] = zipcodes[0] if zipcodes else ''
-            p['Email Address'] = emails[0] if emails else ''
-            p['Cell Phone Number'] = first[5]
-            # Populate orgs
-            total = 0
-            for i in range(6, len(first) - 1):
-                member = max([int(c[i]) for c in candidates])
-                total += member
-                p[col_names[i]] = member
-
-            p['Total Orgs'] = total
-            people4.append(list(p.values()))
-        return people4
-
-    def merge_people_with_same_name_only(d: dict, col_names):
-        people5 = []
-        for candidates in d.values():
-            p = OrderedDict()
-            first = candidates[0]
-            # find all valid values if exist per field of each candidate
-            addresses = [c[2] for c in candidates if c[2]]
-            zipcodes = [c[3] for c in candidates if c[3]]
-            phones = [c[5] for c in candidates if c[5]]
-            emails = [c[4] for c in candidates if c[4]]
-            address5 = addresses[0] if addresses else ''
-            # Populate the person's details
-            p['First Name'] = first[0]
-            p['Last Name'] = first[1]
-            p['Physical Address'] = f'"{address5}"'
-            p['Zip Code'] = zipcodes[0] if zipcodes else ''
-            p['Email Address'] = emails[0] if emails else ''
-            p['Cell Phone Number'] = phones[0] if phones else ''
-            # Populate orgs
-            total = 0
-            for i in range(6, len(first) - 1):
-                member = max([int(c[i]) for c in candidates])
-                total += member
-                p[col_names[i]] = member
-
-            p['Total Orgs'] = total
-            people5.append(list(p.values()))
-        return people5
-
-    def read_field(name):
-        return row[name].strip().lower().replace('nan', '')
-
-    d = dict(people_without_full_name_and_email=defaultdict(list),
-             people_with_full_name_and_email=defaultdict(list),
-             people_with_full_name_and_address=defaultdict(list),
-             people_with_full_name_and_cell_phone=defaultdict(list),
-             people_with_full_name_only=defaultdict(list))
-
-    others = []  # people that don't fit any other category (can't be merged)
-
-    all_people = read_all_people_file()
-    col_names = list(all_people.columns)
+    return all_people[cols]
 
-    total_people = len(all_people)
-    for i, row in all_people.iterrows():
-        if i % 10000 == 0:
-            curr_time = datetime.now().strftime('%H:%M')
-            print(f"[{curr_time}] {i:,} / {total_people:,}, {i * 100 / total_people:.2f}% complete")
 
-        first_name = read_field('First Name')
-        last_name = read_field('Last Name')
-        email = read_field('Email Address')
-        address = f'''"{read_field('Physical Address')}"'''
-        cell_phone = read_field('Cell Phone Number')
-
-        has_full_name = first_name and last_name
-        if has_full_name and email:
-            d['people_with_full_name_and_email'][
-                f'{first_name}, {last_name}, {email}'].append(list(row))
-        elif email:
-            d['people_without_full_name_and_email'][
-                f'{first_name}, {last_name}, {email}'].append(list(row))
-        elif has_full_name and address:
-            d['people_with_full_name_and_address'][
-                f'{first_name}, {last_name}, {address}'].append(list(row))
-        elif has_full_name and cell_phone:
-            d['people_with_full_name_and_cell_phone'][
-                f'{first_name}, {last_name}, {cell_phone}'].append(list(row))
-        elif not (address or cell_phone):
-            d['people_with_full_name_only'][
-                f'{first_name}, {last_name}'].append(list(row))
-        else:
-            others.append(list(row))
-
-    # Print stats
-    print('People with full name and email:', len(d['people_with_full_name_and_email']))
-    print('People with email, but without full name:', len(d['people_without_full_name_and_email']))
-    print('People with full name and address:', len(d['people_with_full_name_and_address']))
-    print('People with full name and cell phone:', len(d['people_with_full_name_and_cell_phone']))
-    print('People with full name only:', len(d['people_with_full_name_only']))
-
-    people = others
-    people += merge_people_with_same_name_and_email(d['people_with_full_name_and_email'], col_names)
-    people += merge_people_with_same_email_and_no_name(d['people_without_full_name_and_email'],
-                                                       col_names)
-    people += merge_people_with_same_name_and_address(d['people_with_full_name_and_address'],
-                                                      col_names)
-    people += merge_people_with_same_name_and_cell_phone(d['people_with_full_name_and_cell_phone'],
-                                                         col_names)
-    people += merge_people_with_same_name_only(d['people_with_full_name_only'], col_names)
-    people = [[x if x != 'nan' else '' for x in p] for p in people]
+@instrument
+def clean_addresses(all_people):
+    """ Replace every address with its canonical form, from the same parse as update_zip_code.
+        The canonical form keeps the zip code, so both stages give the same table when they run
+        again on their own output.
+    """
+    addresses = all_people['Physical Address'].astype(str)
+    parsed = parse_addresses(addresses)
+    zip_codes = (all_people['Zip Code'].astype(str) if 'Zip Code' in all_people.columns
+                 else pd.Series('', index=all_people.index))
+    all_people['Physical Address'] = [canonical_address(a, c, z)
+                                      for a, c, z in zip(addresses, parsed, zip_codes)]
+    return all_people
+
+
+def stage_name(stage):
+    return stage.func.__name__ if isinstance(stage, partial) else stage.__name__
+
+
+@instrument
+def run_pipeline(stages, all_people=None, checkpoint=False, start=1):
+    """ Run stages that each take the people table and return it, in order, on one in-memory
+        DataFrame. The table of generate_output_file is read once (unless all_people is given)
+        and the result is written once at the end to the cleaned people table, so running the
+        stages again starts from the same input. checkpoint=True also writes the cleaned table
+        after every stage; start=i then resumes a failed run at stage i (1 based) from the
+        checkpoint of stage i - 1.
+    """
+    if all_people is None:
+        all_people = read_all_people_file(clean=start > 1)
+    for i, stage in enumerate(stages[start - 1:], start=start):
+        curr_time = datetime.now().strftime('%H:%M')
+        print(f'[{curr_time}] stage {i} / {len(stages)}: {stage_name(stage)}')
+        all_people = stage(all_people)
+        if checkpoint and i < len(stages):
+            write_all_people_file(all_people, clean=True)
+            print(f'[{curr_time}] checkpoint of stage {i} written, resume with start={i + 1}')
+    write_all_people_file(all_people, clean=True)
+    return all_people
+
+
+def people_file(clean=False):
+    """Path of the people table of generate_output_file, or of run_pipeline with clean=True"""
+    if intermediate_format == 'parquet':
+        return clean_people_parquet if clean else all_people_parquet
+    return clean_people_csv if clean else all_people_csv
+
+
+def read_all_people_file(columns=None, clean=False):
+    """ Load the people table, or the cleaned people table with clean=True, optionally only some
+        of its columns, with the compact column types of people_dtypes. Empty fields are ''. A
+        csv written with the sparse membership format gets its org columns back from its
+        membership file.
+    """
+    path = people_file(clean)
+    if intermediate_format == 'parquet':
+        return pd.read_parquet(path, columns=columns)
+    header = pd.read_csv(path, nrows=0).columns
+    if not is_sparse(path, header):
+        return pd.read_csv(path, dtype=people_dtypes(header), usecols=columns,
+                           keep_default_na=False)
+    contact_cols = [c for c in header if c != 'Total Orgs']
+    org_cols, membership = read_membership(membership_path(path))
+    if columns is not None and not set(columns) & set(org_cols):
+        return pd.read_csv(path, dtype=people_dtypes(header), usecols=columns,
+                           keep_default_na=False)
+    df = pd.read_csv(path, dtype=people_dtypes(header), keep_default_na=False)
+    df = pd.concat([df[contact_cols], pd.DataFrame(membership, columns=org_cols, index=df.index),
+                    df[['Total Orgs']]], axis=1)
+    return df if columns is None else df[[c for c in df.columns if c in columns]]
+
+
+def people_dtypes(col_names):
+    """ Column types of the people table: the contact fields as strings (Arrow backed when
+        pyarrow is installed), org membership flags as uint8 and Total Orgs as int32
+    """
+    contact_cols, org_cols = split_columns(col_names)
+    dtypes = {col: string_dtype for col in contact_cols}
+    dtypes.update({col: np.uint8 for col in org_cols})
+    if 'Total Orgs' in col_names:
+        dtypes['Total Orgs'] = np.int32
+    return dtypes
+
+
+def write_all_people_file(df, clean=False):
+    path = people_file(clean)
+    if intermediate_format == 'parquet':
+        df.astype(people_dtypes(df.columns)).to_parquet(path, index=False)
+    elif membership_format == 'sparse':
+        org_cols = split_columns(df.columns)[1]
+        write_membership(membership_path(path), org_cols, df[org_cols].to_numpy(dtype=np.uint8))
+        df.drop(columns=org_cols).to_csv(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def membership_path(csv_path):
+    """Membership file of a people csv written with the sparse membership format"""
+    return os.path.splitext(csv_path)[0] + '_membership.npz'
+
+
+def is_sparse(csv_path, header):
+    """Whether a people csv keeps its org membership in its membership file"""
+    return not split_columns(header)[1] and os.path.isfile(membership_path(csv_path))
+
+
+def write_membership(path, orgs, membership):
+    """ Save a people x orgs 0/1 matrix in compressed sparse row form: the org ids (positions in
+        orgs) of person i are indices[indptr[i]:indptr[i + 1]]. The file grows with the number of
+        memberships, not with people x orgs.
+    """
+    people, org_ids = np.nonzero(membership)
+    indptr = np.zeros(len(membership) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(people, minlength=len(membership)))
+    np.savez_compressed(path, orgs=np.asarray(orgs, dtype=str), indptr=indptr,
+                        indices=org_ids.astype(np.int32))
+
+
+def read_membership(path):
+    """Load a file of write_membership as (org names, people x orgs uint8 matrix)"""
+    with np.load(path) as csr:
+        orgs, indptr, indices = list(csr['orgs']), csr['indptr'], csr['indices']
+    membership = np.zeros((len(indptr) - 1, len(orgs)), dtype=np.uint8)
+    membership[np.repeat(np.arange(len(indptr) - 1), np.diff(indptr)), indices] = 1
+    return orgs, membership
+
+
+def read_people_membership(path=final_merged_people_csv):
+    """Only the org membership of a people csv, dense or sparse: (org names, uint8 matrix)"""
+    header = pd.read_csv(path, nrows=0).columns
+    if is_sparse(path, header):
+        return read_membership(membership_path(path))
+    org_cols = split_columns(header)[1]
+    return org_cols, pd.read_csv(path, usecols=org_cols, dtype=np.uint8)[org_cols].to_numpy()
+
+
+def write_merged_people(contact_cols, org_cols, people):
+    """ Write final_merged_people_csv from rows of contact fields, org flags and Total Orgs. With
+        the sparse membership format the org flags go to its membership file instead.
+    """
+    columns = contact_cols + org_cols + ['Total Orgs']
+    if membership_format == 'sparse':
+        people = list(people)
+        orgs = slice(len(contact_cols), len(contact_cols) + len(org_cols))
+        membership = np.array([row[orgs] for row in people], dtype=np.uint8)
+        write_membership(membership_path(final_merged_people_csv), org_cols,
+                         membership.reshape(len(people), len(org_cols)))
+        people = (row[:orgs.start] + row[-1:] for row in people)
+        columns = contact_cols + ['Total Orgs']
 
     # Creating the CSV file
     with open(final_merged_people_csv, mode='w', newline='', encoding='utf-8') as file:
         writer = csv.writer(file)
 
         # Write the column names
-        writer.writerow(col_names)
+        writer.writerow(columns)
 
         # Write the data rows
         writer.writerows(people)
         print("CSV file created successfully.")
 
 
+def export_all_people_csv():
+    """Write the people table as all_people.csv when the intermediate format is parquet"""
+    read_all_people_file().to_csv(all_people_csv, index=False)
+
+
+def split_columns(col_names):
+    """Split the columns of the people table into (contact columns, org columns)"""
+    contact_cols = [c for c in col_names if c in col_list or c == 'Zip Code']
+    org_cols = [c for c in col_names if c not in contact_cols and c != 'Total Orgs']
+    return contact_cols, org_cols
+
+
+def merge_people(all_people, contact_cols, org_cols):
+    """Merge the records of every cluster row by row (see merge_candidates)"""
+    def read_field(value):
+        return value.lower()
+
+    def first_value(values):
+        return next((v for v in values if v), '')
+
+    key_cols = ['First Name', 'Last Name', 'Email Address', 'Physical Address', 'Cell Phone Number']
+    people = zip(*(all_people[col].map(read_field) for col in key_cols))
+    roots = resolve_identities(people)
+
+    clusters = defaultdict(list)
+    for i, root in enumerate(roots):
+        clusters[root].append(i)
+
+    print('People before merge:', f'{len(all_people):,}')
+    print('People after merge:', f'{len(clusters):,}')
+    report_rows(rows_in=len(all_people), rows_out=len(clusters))
+
+    contacts = all_people[contact_cols].to_numpy()
+    memberships = all_people[org_cols].to_numpy(dtype=np.uint8)
+    name_cols = [contact_cols.index('First Name'), contact_cols.index('Last Name')]
+
+    people = []
+    total_people = len(clusters)
+    for i, members in enumerate(clusters.values(), start=1):
+        if i % 10000 == 0:
+            curr_time = datetime.now().strftime('%H:%M')
+            print(f"[{curr_time}] {i:,} / {total_people:,}, {i * 100 / total_people:.2f}% complete")
+
+        # The name comes from the first record, every other field is the first non-empty value
+        first = contacts[members[0]]
+        p = [first[j] if j in name_cols else first_value(contacts[members, j])
+             for j in range(len(contact_cols))]
+        orgs = memberships[members].max(axis=0)
+        people.append(p + orgs.tolist() + [int(orgs.sum())])
+    return people
+
+
+def read_key_field(all_people, col):
+    return all_people[col].str.lower()
+
+
+def merge_clusters(all_people, roots, contact_cols, org_cols):
+    """ Merge the records of every cluster (roots from resolve_identities_vectorized) with whole
+        column operations. Returns the merged records indexed by the first record of every cluster.
+    """
+    first_rows = np.unique(roots)
+    merged = pd.DataFrame(index=first_rows)
+    for col in contact_cols:
+        values = all_people[col]
+        values = values.where(values != '')
+        if col in ('First Name', 'Last Name'):
+            # The name comes from the first record of the cluster
+            merged[col] = values.to_numpy()[first_rows]
+        else:
+            merged[col] = values.groupby(roots, sort=True).first()
+    merged = merged.fillna('')
+
+    memberships = pd.DataFrame(all_people[org_cols].to_numpy(dtype=np.uint8), columns=org_cols)
+    orgs = memberships.groupby(roots, sort=True).max()
+    merged[org_cols] = orgs
+    merged['Total Orgs'] = orgs.sum(axis=1)
+    return merged
+
+
+def merge_people_vectorized(all_people, contact_cols, org_cols):
+    """ Same as merge_people() with whole column operations: the match keys are built as columns,
+        org membership is reduced with one groupby-max over an integer matrix and the first
+        non-empty value of every contact field is picked with a groupby-first.
+    """
+    key_cols = ['First Name', 'Last Name', 'Email Address', 'Physical Address', 'Cell Phone Number']
+    roots = resolve_identities_vectorized(*(read_key_field(all_people, col) for col in key_cols))
+    merged = merge_clusters(all_people, roots, contact_cols, org_cols)
+
+    print('People before merge:', f'{len(all_people):,}')
+    print('People after merge:', f'{len(merged):,}')
+    report_rows(rows_in=len(all_people), rows_out=len(merged))
+    return merged
+
+
+def merge_block(block, contact_cols, org_cols):
+    """Merge the records of one chunk of blocks (see merge_people_blocked)"""
+    positions = block.index.to_numpy()
+    block = block.reset_index(drop=True)
+    key_cols = ['First Name', 'Last Name', 'Email Address', 'Physical Address', 'Cell Phone Number']
+    roots = resolve_identities_vectorized(*(read_key_field(block, col) for col in key_cols))
+    merged = merge_clusters(block, roots, contact_cols, org_cols)
+    merged.index = positions[merged.index]
+    return merged
+
+
+def merge_people_blocked(all_people, contact_cols, org_cols, workers=None):
+    """ merge_people_vectorized() on blocks of people (see blocking.py) across a process pool.
+        A person never spans two blocks, so ordering the merged records of all blocks by their
+        first record gives the same output as a single pass.
+    """
+    blocks = dedupe_blocks(*(read_key_field(all_people, col) for col in
+                             ['Last Name', 'Email Address', 'Cell Phone Number']))
+    chunks = split_blocks(blocks, (workers or os.cpu_count()) * 4)
+    print(f'{len(np.unique(blocks)):,} blocks in {len(chunks):,} chunks')
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(merge_block, all_people.iloc[rows], contact_cols, org_cols)
+                   for rows in chunks]
+        merged = pd.concat([future.result() for future in futures]).sort_index()
+
+    print('People before merge:', f'{len(all_people):,}')
+    print('People after merge:', f'{len(merged):,}')
+    report_rows(rows_in=len(all_people), rows_out=len(merged))
+    return merged
+
+
+@instrument
+def merge_candidates(all_people=None, vectorized=True, parallel=False, workers=None):
+    """ Merge the records of the same person according to the merge rules in the README.
+        Records are linked transitively (see identity.py), so two records that share a phone on
+        one list and an email on another end up in the same merged row.
+        vectorized=False merges row by row and parallel=True merges blocks of people across a
+        process pool, all give the same output.
+    """
+    if all_people is None:
+        all_people = read_all_people_file(clean=True)
+    contact_cols, org_cols = split_columns(all_people.columns)
+
+    if parallel:
+        merged = merge_people_blocked(all_people, contact_cols, org_cols, workers)
+        people = merged.itertuples(index=False, name=None)
+    elif vectorized:
+        merged = merge_people_vectorized(all_people, contact_cols, org_cols)
+        people = merged.itertuples(index=False, name=None)
+    else:
+        people = merge_people(all_people, contact_cols, org_cols)
+    write_merged_people(contact_cols, org_cols, people)
+
+
+# Cleaning stages, run in order on the people table in memory
+cleaning_stages = [
+    update_org_count_per_person,
+    update_zip_code,
+    clean_addresses,
+]
+
+
 def main():
     """ """
     # convert_files()
@@ -531,13 +823,8 @@ def main():
     # merge_files()
     #generate_output_file()
     # find_suspected_duplicates()
-    #update_org_count_per_person()
-    #update_zip_code()
-    #clean_addresses()
-    #clean_phone_numbers()
-    #clean_nans([
-    #'First Name', 'Last Name', 'Physical Address', 'Email Address'])
-    #merge_candidates()
+    # all_people = run_pipeline(cleaning_stages, checkpoint=False)
+    # merge_candidates(all_people)
 
 
 if __name__ == "__main__":
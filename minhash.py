@@ -0,0 +1,200 @@
+""" Similar emails and addresses with MinHash and locality-sensitive hashing.
+
+    Exact matching never pairs 'jsmith@gmail.com' with 'j.smith@gmail.com' or '12 Oak St' with
+    '12 Oak Street Apt 3', and comparing every pair of values doesn't scale. Every distinct value is
+    cut into character 3-grams (shingles) and summarized by a MinHash signature: the minimum of
+    num_perm random hash functions over its shingles. Two values agree on a signature position with
+    a probability equal to the Jaccard similarity of their shingles. The signatures are split into
+    bands and only values that are identical on a whole band (hash to the same bucket) become
+    candidates, so the work grows with the number of values, not pairs.
+
+    Addresses are compared on their street name only: every address of a town shares the shingles
+    of its city, state and zip code, which would make every address of a town similar to every
+    other. Only addresses with the same house number, unit, directions and (abbreviated) street
+    type can be candidates and their zip codes (or cities) must agree, so '941 Walnut St' and
+    '41 Walnut St', or '12 Walnut St' and '12 Walnut Rd', are different houses.
+
+    find_similar_contacts writes the candidate pairs of the people of merge_files with their
+    estimated similarity to similar_contacts_json, for review next to duplicates_json.
+"""
+from datetime import datetime
+import json
+import re
+import numpy as np
+import pandas as pd
+from address_parser import (abbrev_direction, abbrev_street_type, extract_zip_code,
+                            parse_addresses)
+from config import col_list, similar_contacts_json
+from instrumentation import instrument, report_rows
+from main import read_people_orgs
+
+PRIME = 2 ** 31 - 1
+SHINGLE_SIZE = 3
+NON_ALPHANUMERIC = re.compile(r'[^a-z0-9]+')
+
+
+def shingle_codes(values):
+    """ Shingles of every value as integer codes: a values x positions int64 matrix and a mask of
+        the positions that are shingles of the value (values are shorter than the widest one)
+    """
+    encoded = np.array([v.encode('utf-8') for v in values], dtype=bytes)
+    width = max(encoded.dtype.itemsize, SHINGLE_SIZE)
+    chars = np.frombuffer(encoded.astype(f'S{width}').tobytes(), dtype=np.uint8)
+    chars = chars.reshape(len(values), width).astype(np.int64)
+    codes = chars[:, :-2] << 16 | chars[:, 1:-1] << 8 | chars[:, 2:]
+    lengths = np.char.str_len(encoded)
+    valid = np.arange(codes.shape[1]) < (lengths - SHINGLE_SIZE + 1)[:, None]
+    return codes, valid
+
+
+def minhash_signatures(values, num_perm=128, seed=0, chunk_size=20_000):
+    """values x num_perm MinHash signatures of the shingles of values (see shingle_codes)"""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, PRIME, num_perm)
+    b = rng.integers(0, PRIME, num_perm)
+    signatures = np.empty((len(values), num_perm), dtype=np.int64)
+    for start in range(0, len(values), chunk_size):
+        codes, valid = shingle_codes(values[start:start + chunk_size])
+        for j in range(num_perm):
+            hashes = (a[j] * codes + b[j]) % PRIME
+            hashes[~valid] = PRIME
+            signatures[start:start + chunk_size, j] = hashes.min(axis=1)
+    return signatures
+
+
+def lsh_bands(num_perm, min_similarity):
+    """ Number of bands (a divisor of num_perm) whose threshold, the similarity at which a pair
+        becomes a candidate with a probability of about a half, (1 / bands) ** (bands / num_perm),
+        is the closest to min_similarity
+    """
+    options = [b for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(options, key=lambda b: abs((1 / b) ** (b / num_perm) - min_similarity))
+
+
+def candidate_pairs(signatures, bands=32, max_bucket=100, groups=None):
+    """ Pairs (i < j) of rows of signatures that are identical on at least one band of
+        num_perm / bands positions and, when groups (an integer per row) is given, in the same
+        group. Buckets with more than max_bucket rows are skipped: they are values that are common
+        rather than similar, and would make the pairs quadratic.
+    """
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    mix = np.random.default_rng(1).integers(1, 2 ** 63, rows + 1, dtype=np.uint64) | np.uint64(1)
+    group_hash = np.zeros(n, dtype=np.uint64) if groups is None else (
+        np.asarray(groups).astype(np.uint64) * mix[-1])
+    pairs = []
+    for band in range(bands):
+        band_hash = (signatures[:, band * rows:(band + 1) * rows].astype(np.uint64)
+                     * mix[:-1]).sum(axis=1, dtype=np.uint64) + group_hash
+        order = np.argsort(band_hash, kind='stable')
+        starts = np.flatnonzero(np.diff(band_hash[order], prepend=band_hash[order[:1]] + 1))
+        sizes = np.diff(np.append(starts, n))
+        # Most buckets are pairs, they are taken all at once
+        pair_starts = starts[sizes == 2]
+        pairs.append(np.stack([order[pair_starts], order[pair_starts + 1]], axis=1))
+        for start, size in zip(starts[(sizes > 2) & (sizes <= max_bucket)],
+                               sizes[(sizes > 2) & (sizes <= max_bucket)]):
+            members = order[start:start + size]
+            i, j = np.triu_indices(size, k=1)
+            pairs.append(np.stack([members[i], members[j]], axis=1))
+    pairs = np.concatenate(pairs) if pairs else np.empty((0, 2), dtype=np.int64)
+    pairs.sort(axis=1)
+    return np.unique(pairs, axis=0)
+
+
+def similar_values(values, min_similarity=0.5, num_perm=128, groups=None):
+    """ Pairs of values (in the same group, see candidate_pairs) with an estimated Jaccard
+        similarity of their shingles of at least min_similarity. Returns (i, j, similarity)
+        arrays of positions in values.
+    """
+    signatures = minhash_signatures(values, num_perm)
+    pairs = candidate_pairs(signatures, lsh_bands(num_perm, min_similarity), groups=groups)
+    similarity = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+    keep = similarity >= min_similarity
+    return pairs[keep, 0], pairs[keep, 1], similarity[keep]
+
+
+def address_streets(addresses):
+    """ What similar addresses are found on, for an array of distinct addresses: the street name of
+        every address ('' when it has no house number), a group id per house number, directions
+        and street types, and its unit, zip code and city ('' when unknown)
+    """
+    parsed = [c or {} for c in parse_addresses(pd.Series(addresses, dtype=object))]
+    streets = np.array([c.get('StreetName', '').lower().strip(' ,') if c.get('AddressNumber')
+                        else '' for c in parsed], dtype=str)
+    groups, _ = pd.factorize(pd.Series([
+        ' '.join((c.get('AddressNumber', '').lower(),
+                  abbrev_direction(c.get('StreetNamePreDirectional', '')),
+                  abbrev_street_type(c.get('StreetNamePreType', '')),
+                  abbrev_street_type(c.get('StreetNamePostType', '')),
+                  abbrev_direction(c.get('StreetNamePostDirectional', ''))))
+        for c in parsed]))
+    units = np.array([NON_ALPHANUMERIC.sub('', c.get('OccupancyIdentifier', '').lower())
+                      for c in parsed], dtype=str)
+    zips = np.array([extract_zip_code(c) for c in parsed], dtype=str)
+    cities = np.array([c.get('PlaceName', '').lower().strip(' ,') for c in parsed], dtype=str)
+    return streets, groups, units, zips, cities
+
+
+def places_agree(zips, cities, i, j):
+    """Whether the zip codes, or the cities when either has no zip code, of pairs i, j don't differ"""
+    both_zips = (zips[i] != '') & (zips[j] != '')
+    both_cities = (cities[i] != '') & (cities[j] != '')
+    return np.where(both_zips, zips[i] == zips[j], ~both_cities | (cities[i] == cities[j]))
+
+
+def units_agree(units, i, j):
+    """ Whether the units of pairs i, j don't differ: "12 Oak St" and "12 Oak Street Apt 3" can be
+        the same household, "12 Oak St Apt 3" and "12 Oak St Apt 4" are not
+    """
+    return (units[i] == '') | (units[j] == '') | (units[i] == units[j])
+
+
+@instrument
+def find_similar_contacts(email_similarity=0.7, address_similarity=0.6, num_perm=128):
+    """ Write similar_contacts_json with the pairs of similar (but not equal) emails and addresses
+        of the people of merge_files with their estimated similarity, most similar first, and the
+        people that have every value of these pairs.
+        Addresses are similar when their street names are and the rest of their addresses are the
+        same (see address_streets), so formatting variants of an address have similarity 1.
+    """
+    people = read_people_orgs(columns=col_list)
+    report_rows(rows_in=len(people))
+    records = people.values.tolist()
+
+    similar = {}
+    for field, col, min_similarity in (('by_similar_email', 'Email Address', email_similarity),
+                                       ('by_similar_address', 'Physical Address',
+                                        address_similarity)):
+        values = people[col]
+        codes, values_index = pd.factorize(values.where(values != ''))
+        has_value = codes >= 0
+        rows_of = pd.Series(np.flatnonzero(has_value)).groupby(codes[has_value]).agg(list)
+        curr_time = datetime.now().strftime('%H:%M')
+        print(f'[{curr_time}] {col}: {len(values_index):,} distinct values')
+
+        distinct = values_index.to_numpy(dtype=str)
+        if col == 'Physical Address':
+            compared, groups, units, zips, cities = address_streets(distinct)
+        else:
+            compared, groups = distinct, np.zeros(len(distinct), dtype=np.int64)
+        # Values shorter than a shingle have no signature
+        usable = np.flatnonzero(np.char.str_len(compared) >= SHINGLE_SIZE)
+        i, j, similarity = similar_values(compared[usable], min_similarity, num_perm,
+                                          groups[usable])
+        i, j = usable[i], usable[j]
+        if col == 'Physical Address':
+            keep = places_agree(zips, cities, i, j) & units_agree(units, i, j)
+            i, j, similarity = i[keep], j[keep], similarity[keep]
+
+        order = np.argsort(-similarity, kind='stable')
+        similar[field] = dict(
+            pairs=[dict(values=[values_index[i[k]], values_index[j[k]]],
+                        similarity=float(similarity[k])) for k in order],
+            people={values_index[v]: [records[r] for r in rows_of[v]]
+                    for v in np.unique(np.concatenate([i, j]))},
+        )
+        print(f'Similar {col} pairs:', f'{len(order):,}')
+
+    json.dump(similar, open(similar_contacts_json, 'w'), indent=2)
+    print('Similar contacts created:', similar_contacts_json)
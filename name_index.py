@@ -0,0 +1,120 @@
+from collections import defaultdict
+import numpy as np
+from pyxdameraulevenshtein import damerau_levenshtein_distance
+
+
+def deletion_variants(word, max_deletes):
+    """Return all the strings that can be made by deleting up to max_deletes characters from word
+    """
+    variants = {word}
+    edge = {word}
+    for _ in range(max_deletes):
+        edge = {w[:i] + w[i + 1:] for w in edge for i in range(len(w))}
+        variants |= edge
+    return variants
+
+
+class NameIndex:
+    """ Fuzzy name index based on symmetric deletion (the SymSpell approach).
+
+        Every name added to the index is stored under all the strings that can be made by deleting
+        up to max_distance characters from it. Two names within max_distance edits (insertions,
+        deletions, substitutions or transpositions) of each other always share at least one of
+        these deletion variants, so looking up the variants of a name gives a small set of
+        candidates that are then verified with damerau_levenshtein_distance. This returns exactly
+        the same matches as comparing the name against every name in the index.
+
+        A name has a hundred variants or more, so they are kept as (variant hash, name id) pairs
+        in numpy arrays sorted by hash, 12 bytes a variant instead of a dict entry and a list
+        each. New variants go to a small dict first and become a sorted run every buffer_size
+        variants. A run is merged with the run before it while that one is at most 8 times its
+        size, so the sizes of the runs grow geometrically, there are only a few of them to look
+        up and every variant is copied O(log n) times instead of at every flush.
+    """
+
+    def __init__(self, max_distance=2, buffer_size=250_000):
+        self.max_distance = max_distance
+        self.buffer_size = buffer_size
+        self.names = []
+        self.ids = {}
+        # Variants are stored by hash to keep the index small, a collision only adds a candidate
+        # that is then rejected by the distance check
+        # Sorted runs of (variant hashes, name ids), largest first
+        self.runs = []
+        self.pending = defaultdict(list)
+        self.pending_size = 0
+        # The variant hashes of the last name looked up, which is usually the next one added
+        self.last_lookup = None, None
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        if name in self.ids:
+            return
+        i = len(self.names)
+        self.names.append(name)
+        self.ids[name] = i
+        variants = self.variant_hashes(name)
+        for h in variants.tolist():
+            self.pending[h].append(i)
+        self.pending_size += len(variants)
+        if self.pending_size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Add the pending variants as a sorted run and merge the runs of similar size"""
+        hashes = np.fromiter((h for h, ids in self.pending.items() for _ in ids), dtype=np.int64,
+                             count=self.pending_size)
+        name_ids = np.fromiter((i for ids in self.pending.values() for i in ids), dtype=np.int32,
+                               count=self.pending_size)
+        self.pending.clear()
+        self.pending_size = 0
+        while self.runs and len(self.runs[-1][0]) <= 8 * len(hashes):
+            run_hashes, run_ids = self.runs.pop()
+            hashes = np.concatenate([run_hashes, hashes])
+            name_ids = np.concatenate([run_ids, name_ids])
+            # Free the merged run before the sort
+            del run_hashes, run_ids
+        # Sorted runs one after the other, which the stable sort merges in linear time
+        order = np.argsort(hashes, kind='stable')
+        hashes = hashes[order]
+        self.runs.append((hashes, name_ids[order]))
+
+    def variant_hashes(self, name):
+        """Sorted hashes of the deletion variants of name"""
+        if self.last_lookup[0] != name:
+            variants = deletion_variants(name, self.max_distance)
+            self.last_lookup = name, np.sort(np.fromiter(map(hash, variants), dtype=np.int64,
+                                                         count=len(variants)))
+        return self.last_lookup[1]
+
+    def candidates(self, name, limit):
+        """Ids below limit of the names that share a deletion variant with name"""
+        variants = self.variant_hashes(name)
+        ids = set()
+        for hashes, name_ids in self.runs:
+            starts = np.searchsorted(hashes, variants)
+            found = hashes[np.minimum(starts, len(hashes) - 1)] == variants
+            starts = starts[found]
+            ends = np.searchsorted(hashes, variants[found], side='right')
+            # The positions of every matching range, without a Python loop over the ranges
+            sizes = ends - starts
+            positions = np.repeat(ends - sizes.cumsum(), sizes) + np.arange(sizes.sum())
+            ids.update(name_ids[positions].tolist())
+        if self.pending:
+            get = self.pending.get
+            for h in variants.tolist():
+                ids.update(get(h, ()))
+        return sorted(i for i in ids if i < limit)
+
+    def find(self, name):
+        """Return the first added name within max_distance of name or None if there isn't one"""
+        # An exact match is at distance 0, so only names added before it can win
+        limit = self.ids.get(name, len(self.names))
+        for i in self.candidates(name, limit):
+            n = self.names[i]
+            if (abs(len(n) - len(name)) <= self.max_distance and
+                    damerau_levenshtein_distance(n, name) <= self.max_distance):
+                return n
+        return self.names[limit] if limit < len(self.names) else None
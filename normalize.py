@@ -0,0 +1,77 @@
+""" Normalization of the contact fields, applied once to every org list as it is read by
+    merge_files. Everything downstream works on these values as they are.
+"""
+import re
+import pandas as pd
+from config import col_list
+
+WHITESPACE = re.compile(r'\s+')
+NON_DIGITS = re.compile(r'\D+')
+ZIP_CODE = re.compile(r'^(\d{3,5})(?:-?\d{4})?$')
+# Phone numbers stored as numbers in a sheet come out as '6175551234.0'
+FLOAT_SUFFIX = re.compile(r'\.0+$')
+
+# Whole values (after case and whitespace folding) that mean "no value"
+NULL_VALUES = {'', 'nan', 'none', 'null', 'n/a', 'na', '-', '--', '?'}
+# Only placeholders that can't be a name: 'Na', 'Nan' and 'None' are real names
+NULL_NAMES = {'', 'null', 'n/a', '-', '--', '?'}
+NULL_EMAILS = NULL_VALUES | {'no email', 'noemail', 'x'}
+NULL_PHONES = NULL_VALUES | {'y', 'x', 'no call', 'nocall', 'null, null'}
+
+
+def fold_whitespace(values):
+    return values.str.replace(WHITESPACE, ' ', regex=True).str.strip()
+
+
+def drop_nulls(values, null_values):
+    return values.where(~values.str.lower().isin(null_values), '')
+
+
+def normalize_names(values):
+    """ Collapse whitespace. The case is kept ('McDonald', 'van der Berg'): the match keys fold it
+        (see main.read_key_field), so 'JOHN  smith' and 'John Smith' are still the same person
+    """
+    return drop_nulls(fold_whitespace(values), NULL_NAMES)
+
+
+def normalize_emails(values):
+    return drop_nulls(values.str.replace(WHITESPACE, '', regex=True).str.lower(), NULL_EMAILS)
+
+
+def normalize_phones(values):
+    """Digits only, without the US country code"""
+    phones = drop_nulls(fold_whitespace(values), NULL_PHONES)
+    digits = phones.str.replace(FLOAT_SUFFIX, '', regex=True)
+    digits = digits.str.replace(NON_DIGITS, '', regex=True)
+    has_country_code = (digits.str.len() == 11) & digits.str.startswith('1')
+    return digits.where(~has_country_code, digits.str[1:])
+
+
+def normalize_addresses(values):
+    return drop_nulls(fold_whitespace(values), NULL_VALUES)
+
+
+def normalize_zip_codes(values):
+    """5 digit zip codes, restoring the leading zeros Excel drops ('2458' -> '02458')"""
+    zip_codes = values.str.strip().str.extract(ZIP_CODE, expand=False).fillna('')
+    return zip_codes.where(zip_codes == '', zip_codes.str.zfill(5))
+
+
+normalizers = {
+    'First Name': normalize_names,
+    'Last Name': normalize_names,
+    'Physical Address': normalize_addresses,
+    'Email Address': normalize_emails,
+    'Cell Phone Number': normalize_phones,
+}
+
+
+def normalize_people(df):
+    """ Return the col_list columns of an org list (read with dtype=str), normalized. Missing
+        columns and missing values are ''.
+    """
+    people = pd.DataFrame(index=df.index)
+    for col in col_list:
+        values = df[col].fillna('') if col in df.columns else pd.Series('', index=df.index)
+        people[col] = normalizers[col](values.astype(str))
+    return people